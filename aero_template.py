@@ -0,0 +1,137 @@
+class AeroProfileTemplate:
+    """Скомпилированный шаблон профиля AeroClub: постоянные части xml собираются один раз при создании,
+    при формировании профиля подставляются только значения полей с экранированием.\n
+    Полный формат побайтно совпадает с xml.tostring для дерева, построенного через xml.Element.
+    Компактный формат объявляет пространства имен только в корне profiles, без повторов во вложенных элементах.
+    """
+    NS_XSI = 'http://www.w3.org/2001/XMLSchema-instance'
+    NS_XS = 'http://www.w3.org/2001/XMLSchema'
+    NS_PROFILES = 'http://integration.aeroclub.ru/hub/schemas/profiles'
+    PROPERTY_IDENTIFIERS = ('Employee ID', 'GRADE', 'Position', 'Department', 'Structural division', 'Cost Center', 'Line manager email')
+
+    def __init__(self, compact: bool = False) -> None:
+        self.compact = compact
+        root_ns = f' xmlns:xsi="{self.NS_XSI}" xmlns:xs="{self.NS_XS}" xmlns="{self.NS_PROFILES}"'
+        ns = '' if compact else f' xmlns:xs="{self.NS_XS}" xmlns="{self.NS_PROFILES}"'
+        ns_xsi = '' if compact else root_ns
+        self.profiles_open = f'<profiles{root_ns}>'.encode('ascii')
+        self.profiles_close = b'</profiles>'
+        self.profiles_empty = f'<profiles{root_ns} />'.encode('ascii')
+        self.termination_nil = '<dateOfTermination xsi:nil="true" />'
+        self.analytics_open = f'<analytics{ns}><properties{ns}>'
+        self.analytics_close = '</properties></analytics>'
+        self.property_open = tuple(f'<property{ns}><identifier>{identifier}</identifier>' for identifier in self.PROPERTY_IDENTIFIERS)
+        self.contacts_open = f'<contacts{ns}><emailAddress{ns} kind="Work">'
+        self.contacts_close = '</emailAddress></contacts>'
+        self.documents_open = f'<documents{ns}><document{ns_xsi} type="'
+        self.expires_nil = '<expiresOn xsi:nil="true" />'
+
+    @staticmethod
+    def _serialization_error(value):
+        raise TypeError(f'cannot serialize {value!r} (type {type(value).__name__})')
+
+    @classmethod
+    def escape_text(cls, text: str) -> str:
+        """Экранирование текста элемента (как в xml.etree.ElementTree)."""
+        try:
+            if '&' in text:
+                text = text.replace('&', '&amp;')
+            if '<' in text:
+                text = text.replace('<', '&lt;')
+            if '>' in text:
+                text = text.replace('>', '&gt;')
+            return text
+        except (TypeError, AttributeError):
+            cls._serialization_error(text)
+
+    @classmethod
+    def escape_attrib(cls, text: str) -> str:
+        """Экранирование значения атрибута (как в xml.etree.ElementTree)."""
+        try:
+            if '&' in text:
+                text = text.replace('&', '&amp;')
+            if '<' in text:
+                text = text.replace('<', '&lt;')
+            if '>' in text:
+                text = text.replace('>', '&gt;')
+            if '"' in text:
+                text = text.replace('"', '&quot;')
+            if '\r' in text:
+                text = text.replace('\r', '&#13;')
+            if '\n' in text:
+                text = text.replace('\n', '&#10;')
+            if '\t' in text:
+                text = text.replace('\t', '&#09;')
+            return text
+        except (TypeError, AttributeError):
+            cls._serialization_error(text)
+
+    @classmethod
+    def element(cls, tag: str, text) -> str:
+        """Элемент с текстом, пустое значение дает короткую форму <tag />."""
+        return f'<{tag}>{cls.escape_text(text)}</{tag}>' if text else f'<{tag} />'
+
+    def render(self, unique_id, company, first_name, last_name, middle_name, gender, birthday,
+               termination, properties, email, document) -> bytes:
+        """Формирование профиля.
+
+        Args:
+            unique_id (str): табельный номер
+            company (str): идентификатор компании в агентстве
+            first_name (tuple): имя (russian, english)
+            last_name (tuple): фамилия (russian, english)
+            middle_name (str): отчество (russian), english всегда пустой
+            gender (str): пол
+            birthday (str): дата рождения
+            termination (str): дата увольнения или None
+            properties (tuple): значения доп. полей в порядке PROPERTY_IDENTIFIERS
+            email (str): рабочий email
+            document (tuple): (type, series, number, issuedOn, expiresOn, placeOfBirth, firstName, lastName, iso3611-a2) или None
+
+        Returns:
+            bytes: профиль в кодировке us-ascii (не-ascii символы - ссылками &#NNNN;)
+        """
+        element = self.element
+        parts = [
+            f'<profile uniqueIdentifier="{self.escape_attrib(unique_id)}" companyUniqueIdentifier="{self.escape_attrib(company)}">',
+            '<firstName>', element('russian', first_name[0]), element('english', first_name[1]), '</firstName>',
+            '<middleName>', element('russian', middle_name), '<english /></middleName>',
+            '<lastName>', element('russian', last_name[0]), element('english', last_name[1]), '</lastName>',
+            element('gender', gender),
+            element('dateOfBirth', birthday),
+            element('dateOfTermination', termination) if termination else self.termination_nil,
+            self.analytics_open,
+        ]
+        for property_open, value in zip(self.property_open, properties):
+            parts += (property_open, element('value', value), '</property>')
+        parts += (self.analytics_close, self.contacts_open, element('address', email), self.contacts_close)
+        if document:
+            doc_type, series, number, issued_on, expires_on, place_of_birth, doc_first_name, doc_last_name, iso = document
+            parts += (
+                self.documents_open, self.escape_attrib(doc_type), '">',
+                element('series', series), element('number', number), element('issuedOn', issued_on),
+                element('expiresOn', expires_on) if expires_on else self.expires_nil,
+                element('placeOfBirth', place_of_birth), element('firstName', doc_first_name), element('lastName', doc_last_name),
+                '<citizenship><code>', element('iso3611-a2', iso), '</code></citizenship></document></documents>',
+            )
+        parts.append('</profile>')
+        return ''.join(parts).encode('ascii', 'xmlcharrefreplace')
+
+    def document(self, profiles: bytes) -> bytes:
+        """Оборачивание профилей в корень profiles."""
+        return self.profiles_open + profiles + self.profiles_close if profiles else self.profiles_empty
+
+    @staticmethod
+    def is_equivalent(full: bytes, compact: bytes) -> bool:
+        """Проверка семантической эквивалентности двух документов: канонические формы (C14N 2.0) совпадают,
+        т.е. совпадают имена элементов с учетом пространств имен, атрибуты и тексты.
+
+        Args:
+            full (bytes): документ в полном формате
+            compact (bytes): документ в компактном формате
+
+        Returns:
+            bool: True если документы эквивалентны
+        """
+        import xml.etree.ElementTree as xml # нужен только для проверки компактного формата
+        return xml.canonicalize(full.decode('ascii')) == xml.canonicalize(compact.decode('ascii'))
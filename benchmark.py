@@ -0,0 +1,186 @@
+import logging
+import multiprocessing
+import itertools
+import json
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from config import Configuration
+from synthetic import SyntheticRows
+
+def peak_rss_mb() -> float:
+    """Пиковый объем памяти (RSS) текущего процесса в МБ, None - если платформа не поддерживается."""
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                        ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                        ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                        ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        get_current_process = ctypes.windll.kernel32.GetCurrentProcess
+        get_current_process.restype = wintypes.HANDLE
+        get_memory_info = ctypes.windll.psapi.GetProcessMemoryInfo
+        get_memory_info.argtypes = [wintypes.HANDLE, ctypes.POINTER(PROCESS_MEMORY_COUNTERS), wintypes.DWORD]
+        if not get_memory_info(get_current_process(), ctypes.byref(counters), counters.cb):
+            return None
+        return counters.PeakWorkingSetSize / 2**20
+    try: # linux: пик по памяти самого процесса, ru_maxrss после exec наследует пик родителя
+        with open('/proc/self/status', encoding='ascii') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 2**10
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10 # macOS - байты, linux - КБ
+
+#region Этапы замера: (config, rows) -> (секунд, байт результата или None)
+def _chunks(rows: list, size: int):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+def _travel_build(config, rows):
+    from data_parser import TravelParser
+    parser, elapsed = TravelParser(config, None), 0.0
+    for chunk in _chunks(rows, Benchmark.CHUNK_SIZE): # частями, чтобы в памяти не копились все сотрудники
+        started = time.perf_counter()
+        parser._create_employees_travel(chunk)
+        elapsed += time.perf_counter() - started
+    return elapsed, None
+
+def _travel_json(config, rows):
+    from data_parser import TravelParser
+    parser, elapsed, size = TravelParser(config, None), 0.0, 0
+    for chunk in _chunks(rows, Benchmark.CHUNK_SIZE):
+        employees = parser._create_employees_travel(chunk) # формирование в замер не входит
+        started = time.perf_counter()
+        size += sum(len(json.dumps(employee, ensure_ascii=False).encode('utf-8')) for employee in employees)
+        elapsed += time.perf_counter() - started
+    return elapsed, size
+
+def _aero_profile(config, rows):
+    from data_parser import AeroParser
+    from row_layout import AERO_LAYOUT
+    from validation import AERO_RULES
+    parser, size = AeroParser(config, None), 0
+    started = time.perf_counter()
+    validate = AERO_RULES.compile(AERO_LAYOUT.default) # один раз на набор строк, как в _render_aero_rows
+    for row in rows:
+        try:
+            size += len(parser._create_profile_aero_xml_db(row, Benchmark.COMPANY, validate=validate))
+        except Exception: # строки с незаполненными полями
+            pass
+    return time.perf_counter() - started, size
+
+def _aero_xml(config, rows):
+    from data_parser import AeroParser
+    parser = AeroParser(config, None)
+    started = time.perf_counter()
+    xml, _ = parser._createXML_aero(rows, Benchmark.COMPANY)
+    elapsed = time.perf_counter() - started
+    parser._close_process_pool()
+    return elapsed, len(xml)
+#endregion Этапы замера
+
+def _measure(config, stage: str, count: int, seed: int) -> dict:
+    """Замер одного этапа в отдельном процессе, чтобы пиковая память относилась только к нему."""
+    logging.disable(logging.CRITICAL) # ошибки строк с незаполненными полями ожидаемы и в лог не пишутся
+    agency, func = Benchmark.STAGES[stage]
+    holding_role = config.settings.CbtcTravelClick.newUser.holdingUserRole
+    generator = SyntheticRows(seed, holding_role=holding_role)
+    rows = list(generator.travel(count) if agency == Configuration.AGENCY_CBTC else generator.aero(count))
+    elapsed, size, total, repeats = None, None, 0.0, 0
+    while repeats < Benchmark.REPEATS and (not repeats or total < Benchmark.MIN_SECONDS): # лучший из повторов
+        seconds, size = func(config, rows)
+        elapsed = seconds if elapsed is None else min(elapsed, seconds)
+        total, repeats = total + seconds, repeats + 1
+    peak = peak_rss_mb()
+    return {
+        'rows_per_sec': round(count / elapsed, 1) if elapsed else None,
+        'bytes_per_row': round(size / count, 1) if size is not None and count else None,
+        'peak_rss_mb': round(peak, 1) if peak is not None else None,
+    }
+
+class Benchmark:
+    """Замер формирования и сериализации профилей на синтетических строках (synthetic.SyntheticRows):
+    строк в секунду, байт результата на строку и пиковая память процесса по каждому этапу и объему.
+    Результаты сравниваются с сохраненным базовым замером.
+    """
+    DEFAULT_ROWS = (1000, 100000, 1000000)
+    DEFAULT_BASELINE = './benchmark/baseline.json'
+    DEFAULT_TOLERANCE = 0.1 # допустимое ухудшение относительно базового замера
+    CHUNK_SIZE = 10000      # строк в части формирования employees_travel
+    REPEATS = 3             # повторов этапа, в результат берется лучшее время
+    MIN_SECONDS = 2.0       # этап повторяется, пока суммарное время меньше
+    COMPANY = 'SYNTHETIC'
+    STAGES = {
+        'travel_build': (Configuration.AGENCY_CBTC, _travel_build),  # _create_employees_travel
+        'travel_json': (Configuration.AGENCY_CBTC, _travel_json),    # json.dumps сотрудников
+        'aero_profile': (Configuration.AGENCY_AERO, _aero_profile),  # _create_profile_aero_xml_db
+        'aero_xml': (Configuration.AGENCY_AERO, _aero_xml),          # _createXML_aero
+    }
+
+    def __init__(self, config: Configuration) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.config = config
+        self.rows = config.benchmark_rows or self.DEFAULT_ROWS
+        self.seed = config.benchmark_seed
+        self.baseline_path = Path(config.benchmark_baseline or self.DEFAULT_BASELINE)
+
+    def _load_baseline(self) -> dict:
+        if not self.baseline_path.exists():
+            self.logger.info(f"Базовый замер '{self.baseline_path}' не найден, сравнение не выполняется.")
+            return dict()
+        with open(self.baseline_path, encoding='utf-8') as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline.get('seed') != self.seed:
+            self.logger.warning(f"Базовый замер выполнен с seed '{baseline.get('seed')}', текущий '{self.seed}': строки различаются.")
+        return baseline.get('results', dict())
+
+    def _compare(self, current: dict, base: dict) -> str:
+        """Сравнение с базовым замером: изменение скорости и памяти, ухудшение больше допустимого пишется в лог предупреждением."""
+        if not base:
+            return ''
+        notes, regress = list(), False
+        for key, better in (('rows_per_sec', 1), ('peak_rss_mb', -1)):
+            if current.get(key) and base.get(key):
+                change = current[key] / base[key] - 1
+                notes.append(f'{key} {change:+.1%}')
+                regress = regress or change * better < -self.DEFAULT_TOLERANCE
+        return ('РЕГРЕСС: ' if regress else 'к базовому: ') + ', '.join(notes)
+
+    def run(self) -> dict:
+        """Замер всех этапов на всех объемах строк.
+
+        Returns:
+            dict: этап -> количество строк -> показатели
+        """
+        self.logger.info(f"Замер производительности: строк {', '.join(map(str, self.rows))}, seed '{self.seed}'")
+        baseline = self._load_baseline()
+        results = dict()
+        context = multiprocessing.get_context('spawn')
+        for stage, count in itertools.product(self.STAGES, self.rows):
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                current = executor.submit(_measure, self.config, stage, count, self.seed).result()
+            results.setdefault(stage, dict())[str(count)] = current
+            comparison = self._compare(current, baseline.get(stage, dict()).get(str(count)))
+            message = (f"{stage:<13} строк {count:>8}: {current['rows_per_sec'] or 0:>10,.0f} строк/с, "
+                       f"байт/строка {current['bytes_per_row'] or '-'}, пик памяти {current['peak_rss_mb'] or '-'} МБ. {comparison}")
+            (self.logger.warning if comparison.startswith('РЕГРЕСС') else self.logger.info)(message)
+
+        if self.config.save_baseline:
+            self.baseline_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.baseline_path, mode='w', encoding='utf-8') as baseline_file:
+                json.dump({'seed': self.seed, 'python': sys.version.split()[0], 'results': results}, baseline_file, ensure_ascii=False, indent=2)
+            self.logger.info(f"Базовый замер сохранен: '{self.baseline_path}'")
+        return results
@@ -1,21 +1,37 @@
 import argparse
-import yaml, json, os, sys
-from cryptography.fernet import Fernet
+import yaml, os, sys
+import contextvars
+import atexit, queue, time
 from pathlib import Path
 import logging.config
+import logging.handlers
 
 prog_name = 'AeroTravel.exe'
 prog_version = '2.1'
 prog_version_date = '18.11.2024'
 prog_description = 'Подготовка и отправка данных для AeroClub и CbtcTravelClick'
 
+# ключ компании, обрабатываемой в текущем потоке, для пометки сообщений лога.
+current_company = contextvars.ContextVar('current_company', default=None)
+
 class Settings:
     def __init__(self, settings_dict):
         self.__dict__.update(settings_dict)
-        engine = Fernet(Configuration.KEY)
-        if "password" in settings_dict.keys():
-            password = settings_dict.get("password")
-            self.decrypted_password = engine.decrypt(password).decode()
+    def __getattr__(self, name):
+        # пароль секции расшифровывается при первом обращении к decrypted_password (только у секций с password),
+        # секции, не используемые запуском, не расшифровываются.
+        if name == 'decrypted_password' and 'password' in self.__dict__:
+            self.decrypted_password = Configuration.engine().decrypt(self.__dict__['password']).decode()
+            return self.decrypted_password
+        raise AttributeError(name)
+    @classmethod
+    def from_yaml(cls, value):
+        """Секции yaml-файла в виде Settings (вложенные словари, в т.ч. в списках), остальные значения без изменений."""
+        if isinstance(value, dict):
+            return cls({str(key): cls.from_yaml(item) for key, item in value.items()})
+        if isinstance(value, list):
+            return [cls.from_yaml(item) for item in value]
+        return value
     def keys(self):
         return self.__dict__.keys()
     def __setitem__(self, key, value):
@@ -30,6 +46,7 @@ class Configuration:
     AGENCY_AERO, AGENCY_CBTC, NEW_USER, TRAVEL_DEV, MAIL_USER = 'AERO', 'CBTC', 'NUSR', 'TDEV', 'SMTP'
     PROXY_ZSCALER, PROXY_SYSTEM, PROXY_NONE = 'zscaler', 'system', 'none'
     KEY = b'02p-Lards_EpJRbSQHn6c1fqZdYBLGBibyFNpPTQ8pA='
+    _engine = None # Fernet, создается при первом шифровании/дешифровании (engine())
     #endregion Конфигурационные константы
     def __init__(self):
         """Инициализация конфигурации приложения.
@@ -52,6 +69,22 @@ class Configuration:
         self.parser.add_argument('-y', dest='section', type=str,
                                  choices=[self.AGENCY_AERO, self.AGENCY_CBTC, self.NEW_USER, self.TRAVEL_DEV, self.MAIL_USER], 
                                  help='Секция в yaml, куда надо вставить пароль.')
+        self.parser.add_argument('-w', '--workers', dest='workers', type=int,
+                                 help='Количество компаний, обрабатываемых параллельно (по умолчанию settings.workers, иначе 1).')
+        self.parser.add_argument('-f', '--full', dest='full_sync', action='store_true', default=False,
+                                 help='Полная выгрузка всех сотрудников без сравнения со снимком прошлой отправки.')
+        self.parser.add_argument('--pipeline', dest='pipeline', action='store_true', default=False,
+                                 help='Конвейерная обработка: чтение из БД, формирование и отправка разных компаний и пачек идут одновременно.')
+        self.parser.add_argument('--profile', dest='profile', action='store_true', default=False,
+                                 help='Профилирование запуска (cProfile и tracemalloc), результаты записываются в каталог логов.')
+        self.parser.add_argument('--benchmark', dest='benchmark', type=int, nargs='*', metavar='ROWS',
+                                 help='Замер формирования и сериализации профилей на синтетических строках (по умолчанию 1000 100000 1000000 строк), без БД и отправки.')
+        self.parser.add_argument('--benchmark-seed', dest='benchmark_seed', type=int, default=1,
+                                 help='Начальное значение генератора синтетических строк (по умолчанию %(default)s).')
+        self.parser.add_argument('--benchmark-baseline', dest='benchmark_baseline', type=str,
+                                 help='Файл базового замера для сравнения (по умолчанию ./benchmark/baseline.json).')
+        self.parser.add_argument('--save-baseline', dest='save_baseline', action='store_true', default=False,
+                                 help='Сохранить результаты замера как базовые.')
         if '-secret' in sys.argv:
             self.parser.add_argument('-secret', dest='secret', action='store_true', default=False,
                                      help='Активация секретных параметров')
@@ -64,7 +97,7 @@ class Configuration:
         with open(self.settings_path, encoding='utf-8') as config_file:
             settings = yaml.safe_load(config_file)
             self.logging_config = settings.get('logging_config')
-            self.settings = json.loads(json.dumps(settings), object_hook=Settings)
+            self.settings = Settings.from_yaml(settings)
             # если у settings есть раздер smtp, у которого есть атрибуты mailuser и password
             # и пароль расшифрован, то меняем его у logging_config.  
             if hasattr(self.settings, 'smtp') and hasattr(self.settings.smtp, 'mailuser') and \
@@ -72,6 +105,12 @@ class Configuration:
                 new_cred = [self.settings.smtp.mailuser, self.settings.smtp.decrypted_password]
                 self.logging_config['handlers']['mail']['credentials'] = new_cred
 
+    def __getstate__(self):
+        """Конфигурация передается в процессы формирования профилей без парсера командной строки (он не сериализуется)."""
+        state = self.__dict__.copy()
+        state.pop('parser', None)
+        return state
+
     def print_old_or_save_new_pass(self) -> None:
         """Печать на экран старого или установка нового пароля"""
         if self.section and not self.password: # Если указан -y (имя секции), но не указан -e (пароль)
@@ -169,9 +208,72 @@ class Configuration:
             Returns: bool: true если дебаг включен.
         """
         return self.settings.settings.debug_limit_off
+    @property
+    def workers(self) -> int:
+        """Параметр командной строки или settings.workers: количество параллельно обрабатываемых компаний.
+            Returns: int: количество потоков, не меньше 1
+        """
+        workers = self.namespace.workers or getattr(self.settings.settings, 'workers', 1)
+        return max(1, int(workers))
+    @property
+    def is_delta_sync(self) -> bool:
+        """Отправка только новых, измененных и уволенных сотрудников (settings.deltaSync), если не указан --full и выключена отладка.
+            Returns: bool: true если включена дельта-синхронизация.
+        """
+        return bool(getattr(self.settings.settings, 'deltaSync', False)) and not self.namespace.full_sync and not self.is_debug_limit_off
+    @property
+    def is_pipeline(self) -> bool:
+        """Параметр командной строки --pipeline или settings.pipeline: конвейерная обработка компаний.
+            Returns: bool: true если включен конвейерный режим.
+        """
+        return self.namespace.pipeline or bool(getattr(self.settings.settings, 'pipeline', False))
+    @property
+    def is_profile(self) -> bool:
+        """Флаг командной строки --profile: профилирование запуска.
+            Returns: bool: true если указан --profile.
+        """
+        return self.namespace.profile
+    @property
+    def is_benchmark(self) -> bool:
+        """Параметр командной строки --benchmark: замер производительности вместо отправки.
+            Returns: bool: true если указан --benchmark.
+        """
+        return self.namespace.benchmark is not None
+    @property
+    def benchmark_rows(self) -> list:
+        """Параметр командной строки --benchmark: объемы строк замера.
+            Returns: list: количества строк, пустой список - объемы по умолчанию
+        """
+        return self.namespace.benchmark
+    @property
+    def benchmark_seed(self) -> int:
+        """Параметр командной строки --benchmark-seed: начальное значение генератора синтетических строк.
+            Returns: int: seed
+        """
+        return self.namespace.benchmark_seed
+    @property
+    def benchmark_baseline(self) -> str:
+        """Параметр командной строки --benchmark-baseline: файл базового замера.
+            Returns: str: путь к файлу или None
+        """
+        return self.namespace.benchmark_baseline
+    @property
+    def save_baseline(self) -> bool:
+        """Флаг командной строки --save-baseline: сохранение результатов замера как базовых.
+            Returns: bool: true если результаты сохраняются
+        """
+        return self.namespace.save_baseline
     #endregion Параметры командной строки в виде свойств.
 
     #region Статические методы шифрования/дешифрования паролей
+    @classmethod
+    def engine(cls):
+        """Общий на процесс объект шифрования Fernet, cryptography импортируется при первом обращении."""
+        if cls._engine is None:
+            from cryptography.fernet import Fernet
+            cls._engine = Fernet(cls.KEY)
+        return cls._engine
+
     @staticmethod
     def encrypt_password(password):
         """Шифрование пароля.
@@ -182,8 +284,7 @@ class Configuration:
         Returns:
             str: зашифрованный пароль
         """
-        engine = Fernet(Configuration.KEY)
-        return engine.encrypt(password.encode()).decode()
+        return Configuration.engine().encrypt(password.encode()).decode()
 
     @staticmethod
     def decrypt_password(password):
@@ -196,13 +297,95 @@ class Configuration:
             str: дешифрованный пароль
         """
         try:
-            return Fernet(Configuration.KEY).decrypt(password).decode()
+            return Configuration.engine().decrypt(password).decode()
         except Exception as e:
             return None
     #endregion Статические методы шифрования/дешифрования паролей
 
+class CompanyLogFilter(logging.Filter):
+    """Фильтр обработчиков лога: добавляет к сообщению ключ компании из current_company.
+    """
+    def filter(self, record) -> bool:
+        company = current_company.get()
+        if company and not hasattr(record, 'company'):
+            record.company = company
+            record.msg = f'[{company}] {record.msg}'
+        return True
+
+class DigestSMTPHandler(logging.handlers.SMTPHandler):
+    """Почтовый обработчик, собирающий сообщения в одно письмо-дайджест: за весь запуск (interval 0)
+    или за окно в interval секунд. Письмо отправляется при закрытии обработчика (logging.shutdown при выходе)
+    или при первом сообщении после окончания окна, а не на каждое предупреждение.\n
+    Подключается в logging_config: class: config.DigestSMTPHandler, параметры SMTPHandler и interval.
+    """
+    MAX_RECORDS = 1000 # сообщений в одном письме, остальные только подсчитываются
+
+    def __init__(self, mailhost, fromaddr, toaddrs, subject, credentials=None, secure=None, timeout=5.0, interval=0):
+        super().__init__(mailhost, fromaddr, toaddrs, subject, credentials, secure, timeout)
+        self.interval = interval
+        self._records = list()
+        self._dropped = 0
+        self._levels = dict()
+        self._window_start = None
+
+    def emit(self, record) -> None:
+        try:
+            if self._window_start is None:
+                self._window_start = time.monotonic()
+            if len(self._records) < self.MAX_RECORDS:
+                self._records.append(self.format(record))
+            else:
+                self._dropped += 1
+            self._levels[record.levelname] = self._levels.get(record.levelname, 0) + 1
+        except Exception:
+            self.handleError(record)
+            return
+        if self.interval and time.monotonic() - self._window_start >= self.interval:
+            self._send_digest()
+
+    def _send_digest(self) -> None:
+        """Отправка накопленных сообщений одним письмом."""
+        if not self._records:
+            return
+        records, dropped, levels = self._records, self._dropped, self._levels
+        self._records, self._dropped, self._levels, self._window_start = list(), 0, dict(), None
+        body = '\n\n'.join(records)
+        if dropped:
+            body += f'\n\n... и еще {dropped} сообщений (см. файл лога)'
+        try:
+            import smtplib # почта нужна только при отправке письма, при запуске не импортируется
+            from email.message import EmailMessage
+            from email.utils import localtime
+            msg = EmailMessage()
+            msg['From'] = self.fromaddr
+            msg['To'] = ','.join(self.toaddrs)
+            msg['Subject'] = f"{self.subject}: {', '.join(f'{level} {count}' for level, count in levels.items())}"
+            msg['Date'] = localtime()
+            msg.set_content(body)
+            smtp = smtplib.SMTP(self.mailhost, self.mailport or smtplib.SMTP_PORT, timeout=self.timeout)
+            if self.username:
+                if self.secure is not None:
+                    smtp.ehlo()
+                    smtp.starttls(*self.secure)
+                    smtp.ehlo()
+                smtp.login(self.username, self.password)
+            smtp.send_message(msg)
+            smtp.quit()
+        except Exception:
+            self.handleError(logging.makeLogRecord({'msg': 'Ошибка отправки письма-дайджеста', 'levelno': logging.ERROR}))
+
+    def close(self) -> None:
+        self.acquire()
+        try:
+            self._send_digest()
+        finally:
+            self.release()
+        super().close()
+
 def setupLogging(config: Configuration):
-    """Установка логирования по параметрам конфигурации из файла.
+    """Установка логирования по параметрам конфигурации из файла.\n
+    При logging_config.queue: True обработчики root (файл, консоль, почта) вызываются в отдельном потоке
+    (QueueListener), а потоки обработки только ставят сообщения в очередь. Очередь разбирается до конца при выходе.
 
     Args:
         config (Configuration): Параметры конфигурации
@@ -213,4 +396,21 @@ def setupLogging(config: Configuration):
 
     path = config.settings.logging_config.handlers.file.filename
     mk_logs_dir(path)
-    logging.config.dictConfig(config.logging_config)
+    logging_config = dict(config.logging_config)
+    queued = bool(logging_config.pop('queue', False))
+    logging.config.dictConfig(logging_config)
+    company_filter = CompanyLogFilter()
+    root = logging.getLogger()
+    if not queued:
+        for handler in root.handlers:
+            handler.addFilter(company_filter)
+        return
+    handlers = list(root.handlers)
+    for handler in handlers:
+        root.removeHandler(handler)
+    queue_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+    queue_handler.addFilter(company_filter) # ключ компании известен только в потоке, создавшем сообщение
+    root.addHandler(queue_handler)
+    listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop) # выполняется до logging.shutdown, который закрывает обработчики и отправляет дайджест
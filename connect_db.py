@@ -1,29 +1,211 @@
 import logging
-import pyodbc
+import queue
+import threading
+
+from timing import stage_timings
+
+class ConnectionPool:
+    """Пул соединений с БД на время запуска приложения: соединения переиспользуются всеми парсерами и хранимыми процедурами,
+    закрываются детерминированно в close() (или при выходе из with).
+    """
+    DEFAULT_POOL_SIZE = 2
+    DEFAULT_BATCH_SIZE = 1000
 
-class ConnectDB:
     def __init__(self, config):
         self.logger = logging.getLogger(__name__)
+        settings = config.settings
+        driver = "DRIVER=" + settings.db.driver
+        server = "SERVER=" + settings.db.server
+        database = "DATABASE=" + settings.db.database
+        type_auth = "Trusted_Connection=yes;"
+        self.conn_str = ";".join([driver, server, database, type_auth])
+        #self.listdrivers = pyodbc.drivers()
+        self.size = getattr(settings.db, 'poolSize', self.DEFAULT_POOL_SIZE)
+        self.batch_size = getattr(settings.db, 'fetchBatchSize', self.DEFAULT_BATCH_SIZE)
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+
+    def _connect(self):
+        self.logger.debug(f'Строка соединения: {self.conn_str}')
+        import pyodbc # драйвер загружается при первом соединении, режимы без БД его не импортируют
+        with stage_timings.measure('db_connect'):
+            return pyodbc.connect(self.conn_str)
+
+    def acquire(self):
+        """Получение соединения из пула. Новое соединение создается, только если свободных нет и размер пула не превышен,
+        иначе ожидается возврат соединения в пул.
+
+        Returns:
+            pyodbc.Connection: соединение с БД
+        """
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            create = self._created < self.size
+            if create:
+                self._created += 1
+        if not create:
+            return self._idle.get()
+        try:
+            return self._connect()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def release(self, conn) -> None:
+        """Возврат соединения в пул."""
+        self._idle.put(conn)
+
+    def reconnect(self, conn):
+        """Замена оборванного соединения новым.
+
+        Args:
+            conn (pyodbc.Connection): оборванное соединение
+
+        Returns:
+            pyodbc.Connection: новое соединение
+        """
+        self.logger.warning('Соединение с БД оборвано, выполняется переподключение')
         try:
-            settings = config.settings
-            driver = "DRIVER=" + settings.db.driver
-            server = "SERVER=" + settings.db.server
-            database = "DATABASE=" + settings.db.database
-            type_auth = "Trusted_Connection=yes;"
-            self.conn_str = ";".join([driver, server, database, type_auth])
-            #self.listdrivers = pyodbc.drivers()
+            conn.close()
+        except Exception:
+            pass
+        try:
+            return self._connect()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def close(self) -> None:
+        """Закрытие всех соединений пула."""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                conn.close()
+            except Exception as ex:
+                self.logger.debug(f'Ошибка закрытия соединения: {str(ex)}')
+        with self._lock:
+            self._created = 0
+        self.logger.debug('Соединения с БД закрыты')
 
-            self.logger.debug(f'Строка соединения: {self.conn_str}')
-            self.conn = pyodbc.connect(self.conn_str)
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class ConnectDB:
+    """Соединение, взятое из пула на время работы с хранимой процедурой. Возвращается в пул в close() (или при выходе из with).
+    """
+    def __init__(self, pool: ConnectionPool):
+        self.logger = logging.getLogger(__name__)
+        self.pool = pool
+        self.batch_size = pool.batch_size
+        self.row_count = 0
+        self.error = None # текст последней ошибки БД, при наличии результат неполный
+        self.columns = None # индексы полей результата (row_layout.Columns), если при вызове передана раскладка
+        self.conn, self.cursor = None, None
+        try:
+            self.conn = pool.acquire()
             self.cursor = self.conn.cursor()
         except Exception as ex:
+            self.error = str(ex)
             self.logger.error(f'Ошибка соединения: {str(ex)}')
 
+    @staticmethod
+    def _is_disconnect(ex: Exception) -> bool:
+        """SQLSTATE класса 08 - ошибки соединения."""
+        import pyodbc
+        return isinstance(ex, pyodbc.Error) and bool(ex.args) and str(ex.args[0]).startswith('08')
+
+    def _execute(self, stored_proc) -> None:
+        """Вызов хранимой процедуры с однократным переподключением при оборванном соединении."""
+        with stage_timings.measure('db_execute'):
+            try:
+                self.cursor.execute(stored_proc)
+            except Exception as ex:
+                if not self._is_disconnect(ex):
+                    raise
+                conn, self.conn, self.cursor = self.conn, None, None
+                self.conn = self.pool.reconnect(conn)
+                self.cursor = self.conn.cursor()
+                self.cursor.execute(stored_proc)
+
     def fetch(self, stored_proc):
         try:
             self.logger.debug(f"Обращение к хранимой процедуре: '{stored_proc}'")
-            self.cursor.execute(stored_proc)
-            return self.cursor.fetchall()
+            self._execute(stored_proc)
+            with stage_timings.measure('db_fetch') as span:
+                rows = self.cursor.fetchall()
+                span.rows = len(rows)
+            return rows
         except Exception as ex:
+            self.error = str(ex)
             self.logger.error(f'Ошибка вызова БД: {str(ex)}')
             return []
+
+    def fetch_iter(self, stored_proc, batch_size=None, layout=None, names=None):
+        """Потоковое чтение результата хранимой процедуры пачками через fetchmany.
+        Процедура вызывается сразу, строки читаются по мере перебора. Количество прочитанных строк накапливается в row_count,
+        при ошибке заполняется error. Если передана раскладка, колонки результата привязываются к ее полям (columns)
+        до чтения строк, несовпадение колонок - ошибка.
+
+        Args:
+            stored_proc (str): вызов хранимой процедуры
+            batch_size (int): размер пачки, по умолчанию db.fetchBatchSize из settings.yaml
+            layout (RowLayout): раскладка строки результата
+            names (dict): имена колонок полей раскладки из settings.yaml
+
+        Returns:
+            Iterator: строки результата (pyodbc.Row)
+        """
+        self.row_count, self.error, self.columns = 0, None, None
+        try:
+            self.logger.debug(f"Потоковое обращение к хранимой процедуре: '{stored_proc}'")
+            self._execute(stored_proc)
+            if layout:
+                self.columns = layout.bind(self.cursor.description, names)
+        except Exception as ex:
+            self.error = str(ex)
+            self.logger.error(f'Ошибка вызова БД: {str(ex)}')
+            return iter(())
+        return self._iter_rows(batch_size or self.batch_size)
+
+    def _iter_rows(self, batch_size: int):
+        try:
+            while True:
+                with stage_timings.measure('db_fetch') as span:
+                    rows = self.cursor.fetchmany(batch_size)
+                    span.rows = len(rows)
+                if not rows:
+                    break
+                self.row_count += len(rows)
+                yield from rows
+        except Exception as ex:
+            self.error = str(ex)
+            self.logger.error(f'Ошибка вызова БД: {str(ex)}')
+
+    def close(self) -> None:
+        """Возврат соединения в пул."""
+        if self.conn is None:
+            return
+        try:
+            self.cursor.close()
+        except Exception:
+            pass
+        self.pool.release(self.conn)
+        self.conn, self.cursor = None, None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,11 +1,86 @@
 import logging
 from datetime import datetime
-import xml.etree.ElementTree as xml
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from collections import deque
+import threading
 import json
+import io
 
 from proxy import Proxy
-from config import Configuration
-from connect_db import ConnectDB
+from config import Configuration, current_company
+from connect_db import ConnectDB, ConnectionPool
+from snapshot import SnapshotStore
+from aero_template import AeroProfileTemplate
+from pipeline import UploadPipeline
+from row_layout import TRAVEL_LAYOUT, AERO_LAYOUT, AERO_LEGACY_LAYOUT
+from validation import TRAVEL_RULES, AERO_RULES, ValidationReport
+from timing import stage_timings
+
+class CompanyResult:
+    """Результат обработки одной компании для итоговой сводки по запуску.
+    """
+    SENT, PARTIAL, NO_CHANGES, SKIPPED, FAILED = 'SENT', 'PARTIAL', 'NO_CHANGES', 'SKIPPED', 'FAILED'
+
+    def __init__(self, company_key: str, company_id: str) -> None:
+        self.company_key = company_key
+        self.company_id = company_id
+        self.rows = 0       # строк из БД
+        self.profiles = 0   # профилей в отправке
+        self.batches = 0    # отправленных пачек
+        self.failed_batches = 0
+        self.failed_profiles = 0
+        self.agency_errors = 0 # ошибок по сотрудникам в ответах агентства
+        self.proxy = None       # прокси и код http последней отправки
+        self.http_status = None
+        self.status = None
+        self.message = ''
+        self._lock = threading.Lock() # пачки конвейера отправляются в нескольких потоках
+
+    def finish(self, status: str, message: str = ''):
+        self.status, self.message = status, message
+        return self
+
+    def add_batch(self, profiles: int, sent: bool) -> None:
+        """Учет отправленной пачки."""
+        self.batches += 1
+        self.profiles += profiles
+        if not sent:
+            self.failed_batches += 1
+            self.failed_profiles += profiles
+
+    def add_response(self, proxy: str, http_status: int, agency_errors: int = 0) -> None:
+        """Учет ответа агентства на пачку: прокси, код http и ошибки по сотрудникам."""
+        with self._lock:
+            self.proxy, self.http_status = proxy, http_status
+            self.agency_errors += agency_errors
+
+    def finish_batches(self):
+        """Итоговый статус по результатам отправки пачек."""
+        if not self.batches: # все измененные строки не прошли проверку - отправлять нечего
+            return self.finish(self.NO_CHANGES, 'нет профилей для отправки')
+        if not self.failed_batches:
+            return self.finish(self.SENT)
+        message = f'неуспешных пачек {self.failed_batches} из {self.batches}'
+        return self.finish(self.FAILED if self.failed_batches == self.batches else self.PARTIAL, message)
+
+class UploadJob:
+    """Компания, подготовленная к отправке: пачки (тело запроса в байтах и табельные номера) и параметры запроса в агентство.
+    Если обработка компании завершена на подготовке, статус result уже заполнен и пачек нет.
+    """
+    def __init__(self, result: CompanyResult, agency_name: str = None, batches=(), url: str = None, headers: dict = None,
+                 username: str = None, password: str = None, compression: str = None, delta=None,
+                 require_content: bool = False, analyze=None) -> None:
+        self.result = result
+        self.agency_name = agency_name
+        self.batches = batches       # Iterable[(bytes, list)], тело None - пачку не удалось сериализовать
+        self.url = url
+        self.headers = headers
+        self.username = username
+        self.password = password
+        self.compression = compression
+        self.delta = delta           # дельта снимка, коммитится по успешно отправленным пачкам
+        self.require_content = require_content # пустой ответ считается ошибкой
+        self.analyze = analyze       # анализ контента ответа агентства: (общая ошибка, отклоненные табельные номера)
 
 class DataParser():
     """Базовый класс всех парсеров.
@@ -31,36 +106,270 @@ class DataParser():
         'other_email': 'gendalf@somemail.ru',
         'tabNum': '00001234'
     }
+    DATE_CACHE_SIZE = 100000 # различных дат в кэше преобразования
+    DEFAULT_SHARD_SIZE = 2000 # строк в одной задаче процесса формирования
+    _date_cache = dict() # 'dd.mm.YYYY' -> 'YYYY-mm-dd', общий для всех парсеров и потоков запуска
     #endregion константы класса
-    
-    def __init__(self, config: Configuration) -> None:
+
+    def __init__(self, config: Configuration, db_pool: ConnectionPool) -> None:
         self.logger = logging.getLogger(__name__)
         self.config = config
+        self.db_pool = db_pool # общий на запуск пул соединений с БД
+        self._debug = config.is_debug_limit_off # вычисляется один раз, а не при каждой подмене значения
+        # процессы формирования профилей (settings.buildProcesses), 0 - формирование в основном процессе
+        self.build_processes = int(getattr(config.settings.settings, 'buildProcesses', 0) or 0)
+        self.shard_size = max(1, int(getattr(config.settings.settings, 'buildShardSize', self.DEFAULT_SHARD_SIZE)))
+        self._process_pool = None
+        self._process_lock = threading.Lock()
+
+    def __getstate__(self):
+        """Парсер передается в процессы формирования без пула соединений с БД и пула процессов."""
+        state = self.__dict__.copy()
+        state['db_pool'], state['_process_pool'], state['_process_lock'] = None, None, None
+        return state
         
     def _camouflage(self, key, realvalue) -> str: 
-        return self.FAKE_PERSON[key] if self.config.is_debug_limit_off else realvalue
+        return self.FAKE_PERSON[key] if self._debug else realvalue
     
     def _convdate(self, datestr) -> str:
-        return datetime.strptime(datestr, '%d.%m.%Y').strftime('%Y-%m-%d') if datestr else ''
+        """Преобразование даты dd.mm.YYYY в YYYY-mm-dd. Даты рождения и выдачи документов часто повторяются,
+        поэтому результат кэшируется и strptime вызывается один раз на различную дату.
+        """
+        if not datestr:
+            return ''
+        converted = self._date_cache.get(datestr)
+        if converted is None:
+            converted = datetime.strptime(datestr, '%d.%m.%Y').strftime('%Y-%m-%d')
+            if len(self._date_cache) >= self.DATE_CACHE_SIZE:
+                self._date_cache.clear()
+            self._date_cache[datestr] = converted
+        return converted
+
+    def _get_process_pool(self):
+        """Пул процессов формирования, создается при первом обращении и общий для всех компаний запуска.
+
+        Returns:
+            ProcessPoolExecutor: пул или None, если формирование идет в основном процессе (в том числе при отладке)
+        """
+        if self.build_processes < 1 or self.config.is_debug_limit_off:
+            return None
+        with self._process_lock:
+            if self._process_pool is None:
+                self.logger.info(f"Формирование профилей в отдельных процессах, процессов '{self.build_processes}'")
+                self._process_pool = ProcessPoolExecutor(max_workers=self.build_processes)
+            return self._process_pool
+
+    def _close_process_pool(self) -> None:
+        with self._process_lock:
+            if self._process_pool is not None:
+                self._process_pool.shutdown()
+                self._process_pool = None
+
+    def _map_shards(self, process_pool, func, rows, *args):
+        """Формирование частей выгрузки в пуле процессов с сохранением порядка строк.
+        Строки передаются в процессы простыми кортежами, одновременно в работе не больше двух частей на процесс.
+
+        Args:
+            process_pool (ProcessPoolExecutor): пул процессов формирования
+            func (Callable): метод парсера, формирующий часть (rows, *args)
+            rows (Iterable): строки из БД
+            args: дополнительные аргументы func
+
+        Yields:
+            Any: результаты func по частям в порядке строк
+        """
+        pending = deque()
+        shard = list()
+        for row in rows:
+            shard.append(tuple(row))
+            if len(shard) >= self.shard_size:
+                pending.append(process_pool.submit(func, shard, *args))
+                shard = list()
+                if len(pending) >= 2 * self.build_processes:
+                    yield pending.popleft().result()
+        if shard:
+            pending.append(process_pool.submit(func, shard, *args))
+        while pending:
+            yield pending.popleft().result()
+
+    def _run_companies(self, company_keys: list, process_company) -> list:
+        """Обработка компаний последовательно или в пуле потоков (settings.workers или --workers).
+        Сообщения лога в потоке компании помечаются ее ключом.
+
+        Args:
+            company_keys (list): ключи компаний из settings.yaml
+            process_company (Callable): обработка одной компании, возвращает CompanyResult
+
+        Returns:
+            list: результаты по компаниям в порядке company_keys
+        """
+        def run(company_key) -> CompanyResult:
+            token = current_company.set(company_key)
+            try:
+                return process_company(company_key)
+            except Exception as ex:
+                self.logger.exception(f'Необработанная ошибка при обработке компании: {str(ex)}')
+                return CompanyResult(company_key, None).finish(CompanyResult.FAILED, str(ex))
+            finally:
+                current_company.reset(token)
+
+        workers = min(self.config.workers, len(company_keys))
+        if workers <= 1:
+            return [run(company_key) for company_key in company_keys]
+        self.logger.info(f"Параллельная обработка компаний, потоков '{workers}'")
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='company') as executor:
+            return list(executor.map(run, company_keys))
+
+    def _safe_prepare(self, company_key: str, prepare) -> UploadJob:
+        """Подготовка компании, необработанная ошибка завершает компанию со статусом FAILED."""
+        try:
+            return prepare(company_key)
+        except Exception as ex:
+            self.logger.exception(f'Необработанная ошибка при обработке компании: {str(ex)}')
+            return UploadJob(CompanyResult(company_key, None).finish(CompanyResult.FAILED, str(ex)))
+
+    def _send_batch(self, job: UploadJob, proxy: Proxy, snapshot, payload: bytes, tab_nums: list) -> bool:
+        """Отправка одной пачки и обновление снимка по ее сотрудникам.
+
+        Args:
+            job (UploadJob): подготовленная компания
+            proxy (Proxy): отправщик запросов
+            snapshot (SnapshotStore): снимок для дельта-синхронизации или None
+            payload (bytes): тело запроса, None - ошибка сериализации (уже в логе)
+            tab_nums (list): табельные номера сотрудников пачки
+
+        Returns:
+            bool: True если пачка принята агентством
+        """
+        if payload is None:
+            return False
+        self.logger.info(f"Отправка данных сотрудников '{job.result.company_id}' в агентство '{job.agency_name}', пачка '{len(tab_nums)}' сотрудников")
+        response_content = proxy.send_data(job.url, job.headers, job.username, job.password, payload, job.compression)
+        sent = response_content is not None and not (job.require_content and not response_content)
+        fatal, rejected = False, set()
+        if sent and job.analyze:
+            with stage_timings.measure('analyze'):
+                fatal, rejected = job.analyze(response_content)
+        job.result.add_response(*proxy.last_request(), 1 if fatal else len(rejected))
+        if not sent or fatal:
+            return False
+        if job.delta: # сотрудники, отклоненные агентством, не сохраняются в снимке и отправляются повторно
+            snapshot.commit(job.delta, [tab_num for tab_num in tab_nums if tab_num not in rejected])
+        return True
+
+    def _send_job(self, job: UploadJob, proxy: Proxy, snapshot) -> CompanyResult:
+        """Последовательная отправка пачек подготовленной компании."""
+        if job.result.status:
+            return job.result
+        for payload, tab_nums in job.batches:
+            job.result.add_batch(len(tab_nums), self._send_batch(job, proxy, snapshot, payload, tab_nums))
+        return job.result.finish_batches()
+
+    def _process_companies(self, company_keys: list, prepare, proxy: Proxy, snapshot) -> list:
+        """Обработка компаний агентства конвейером (settings.pipeline или --pipeline) или в пуле потоков.
+
+        Args:
+            company_keys (list): ключи компаний из settings.yaml
+            prepare (Callable): подготовка компании по ключу, возвращает UploadJob
+            proxy (Proxy): отправщик запросов
+            snapshot (SnapshotStore): снимок для дельта-синхронизации или None
+
+        Returns:
+            list: результаты по компаниям в порядке company_keys
+        """
+        if self.config.is_pipeline:
+            queue_size = getattr(self.config.settings.settings, 'pipelineQueueSize', UploadPipeline.DEFAULT_QUEUE_SIZE)
+            pipeline = UploadPipeline(self.config.workers, queue_size)
+            return pipeline.run(company_keys, lambda company_key: self._safe_prepare(company_key, prepare),
+                                lambda job, payload, tab_nums: self._send_batch(job, proxy, snapshot, payload, tab_nums))
+
+        def process_company(company_key) -> CompanyResult:
+            return self._send_job(prepare(company_key), proxy, snapshot)
+
+        return self._run_companies(company_keys, process_company)
+
+    def _log_summary(self, agency_name: str, results: list) -> None:
+        """Итоговая сводка по компаниям агентства."""
+        lines = [f"Итоги по агентству '{agency_name}':"]
+        for result in results:
+            message = f' ({result.message})' if result.message else ''
+            lines.append(f"  '{result.company_key}' - {result.status}{message}: строк из БД '{result.rows}', профилей '{result.profiles}', пачек '{result.batches}'")
+            stages = stage_timings.format(result.company_key)
+            if stages:
+                lines.append(f"    этапы: {stages}")
+        sent = [result for result in results if result.status in (CompanyResult.SENT, CompanyResult.PARTIAL)]
+        failed = [result for result in results if result.status == CompanyResult.FAILED]
+        lines.append(f"  Компаний '{len(results)}', отправлено '{len(sent)}', профилей '{sum(result.profiles for result in sent)}', с ошибками '{len(failed)}'")
+        self.logger.info('\n'.join(lines))
+
+    def _column_names(self, agency, company=None):
+        """Имена колонок полей раскладки из секции columns компании, иначе агентства.
+
+        Returns:
+            dict: имя поля -> имя колонки или None (привязка по позициям)
+        """
+        columns = getattr(company, 'columns', None) or getattr(agency, 'columns', None)
+        return {field: getattr(columns, field) for field in columns.keys()} if columns else None
+
+    def _batch_size(self, agency, company) -> int:
+        """Размер пачки отправки: batchSize компании, иначе агентства, 0 - без разбиения."""
+        return int(getattr(company, 'batchSize', getattr(agency, 'batchSize', 0)) or 0)
+
+    def _open_snapshot(self):
+        """Открытие снимка для дельта-синхронизации.
+
+        Returns:
+            SnapshotStore: снимок или None, если дельта-синхронизация выключена.
+        """
+        if not self.config.is_delta_sync:
+            self.logger.info('Дельта-синхронизация выключена, отправляются все сотрудники')
+            return None
+        return SnapshotStore(self.config)
 
 class TravelParser(DataParser):
     """Класс-холдер для работы с ТревелКлик.
     """
-    def __init__(self, config: Configuration) -> None:
-        super().__init__(config)
+    def __init__(self, config: Configuration, db_pool: ConnectionPool) -> None:
+        super().__init__(config, db_pool)
         self.FAKE_PERSON['gender'] = 'MALE'
 
-    def _create_employees_travel(self, list_users) -> list:
+    def _create_employees_travel(self, list_users, terminated=(), columns=None) -> list:
         """Подготовка списка сотрудников на передачу в агентство, с предварительной проверкой заполнения.
 
         Args:
-            list_users (list): список сотрудников, полученный из БД.
+            list_users (Iterable): сотрудники, полученные из БД (список или генератор ConnectDB.fetch_iter).
+            terminated (set): табельные номера уволенных сотрудников, их учетные записи деактивируются.
+            columns (Columns): индексы полей строки, по умолчанию позиции TRAVEL_LAYOUT.
+
+        Returns:
+            list: подготовленный для JSON-передачи список сотрудников
+        """
+        report = ValidationReport()
+        users_list_for_json = self._build_employees_travel(list_users, terminated, report, columns)
+        self._log_employees_errors(report)
+        return users_list_for_json
+
+    def _log_employees_errors(self, report: ValidationReport) -> None:
+        if report:
+            body_exception = '\r\n'.join(report.errors)
+            self.logger.error(f'Ошибки при формировании employees_travel ({report.summary()}):\r\n {body_exception}')
+
+    def _build_employees_travel(self, list_users, terminated, report: ValidationReport, columns=None) -> list:
+        """Формирование сотрудников без записи в лог. Строки проверяются правилами TRAVEL_RULES без исключений,
+        нарушения и непредвиденные ошибки формирования накапливаются в report.
+
+        Args:
+            list_users (Iterable): сотрудники, полученные из БД.
+            terminated (set): табельные номера уволенных сотрудников.
+            report (ValidationReport): ошибки строк.
+            columns (Columns): индексы полей строки, по умолчанию позиции TRAVEL_LAYOUT.
 
         Returns:
             list: подготовленный для JSON-передачи список сотрудников
         """
+        c = columns or TRAVEL_LAYOUT.default
+        validate = TRAVEL_RULES.compile(c)
         users_list_for_json = list()
-        user_except = list()
 
         new_user = self.config.settings.CbtcTravelClick.newUser
         password = new_user.decrypted_password
@@ -69,101 +378,91 @@ class TravelParser(DataParser):
         other_user_policy = new_user.otherUserPolicy
 
         for user in list_users:
+            rule = validate(user) # проверка заполнения критичных полей
+            if rule is not None:
+                report.add(f'{user[c.tab_num]:0>8} - {rule.message}', rule.code)
+                continue
+            if user[c.login] is None and f'{user[c.tab_num]:0>8}' in terminated:
+                # деактивация передается только в учетной записи (auth), без логина профиль ушел бы активным;
+                # сотрудник не отправляется и остается в снимке, увольнение будет обработано при следующих запусках
+                report.add(f'{user[c.tab_num]:0>8} - Уволенный сотрудник без логина, деактивация не отправлена.', ValidationReport.TERMINATED_NO_LOGIN)
+                continue
             try:
-                #region Проверка заполнения критичных полей 
-                if not user[7]:
-                    raise Exception("Не заполнен день рождения.")
-                if not user[8]:
-                    raise Exception("Не заполнена страна.")
-                if not user[9]:
-                    raise Exception("Не заполнен пол.")
-                if user[8] == 'RU':
-                    if user[10] is None or user[11] is None:
-                        raise Exception("Не заполнен российский паспорт.")
-                else:
-                    if user[14] is None or user[15] is None:
-                        raise Exception("Не заполнен иностранный паспорт.")
-                if user[17] is None or user[18] is None or user[19] is None:
-                    raise Exception("Не заполнена орг.структура.")
-                if user[22] is None or user[23] is None:
-                    raise Exception("Не заполнены роли.")
-                #endregion Проверка заполнения критичных полей
-                
                 #region Информация о ФИО
                 names = [
                     # Информация о ФИО RU
                     {
                         'lang': 'RU',
-                        'surname': self._camouflage('ru_surname', user[4]),
-                        'name': self._camouflage('ru_name', user[5]),
-                        'middleName': self._camouflage('ru_middleName', user[6])
+                        'surname': self._camouflage('ru_surname', user[c.ru_surname]),
+                        'name': self._camouflage('ru_name', user[c.ru_name]),
+                        'middleName': self._camouflage('ru_middleName', user[c.ru_middle_name])
                     },
                     # Информация о ФИО EN 
                     {
                         'lang': 'EN',
-                        'surname': self._camouflage('en_surname', user[2]),
-                        'name': self._camouflage('en_name', user[3])
+                        'surname': self._camouflage('en_surname', user[c.en_surname]),
+                        'name': self._camouflage('en_name', user[c.en_name])
                     } 
                 ]
                 #endregion Информации о ФИО
 
                 #region Объект аутентификации
                 detailPolicies = []
-                # if user[22] == holding_user_role:
-                #     #select_lm_users = f"exec [dbo].[GetEmpl1Level] {user[1]}"
+                # if user[c.role] == holding_user_role:
+                #     #select_lm_users = f"exec [dbo].[GetEmpl1Level] {user[c.tab_num]}"
                 #     list_detailPolicy = []  # create_connection_fetch(select_lm_users)
                 #     for tab_no in list_detailPolicy:
                 #         detailPolicy = {"type": "USER", "value": tab_no[0]}
                 #         detailPolicies.append(detailPolicy)
 
                 auth = None
-                if user[16] is not None:
+                if user[c.login] is not None:
                     auth = {
-                        'login': self._camouflage('login', user[16]),
-                        'policy': holding_user_policy if user[22]==holding_user_role else other_user_policy,
+                        'login': self._camouflage('login', user[c.login]),
+                        'policy': holding_user_policy if user[c.role]==holding_user_role else other_user_policy,
                         'password': password,
-                        'roles': [user[22]], # роли сотрудника
-                        'activeUser': "TRUE",
+                        'roles': [user[c.role]], # роли сотрудника
+                        'activeUser': "FALSE" if f'{user[c.tab_num]:0>8}' in terminated else "TRUE",
                         'detailPolicies': detailPolicies 
                     }
                 #endregion Объект аутентификации выше
 
                 #region Документы сотрудника
-                _country = self._camouflage('country', user[8])
+                _country = self._camouflage('country', user[c.country])
                 documents = []
-                if user[10]: # на случай, если это инстранный (user[8]!='RU'), у него может не быть российского паспорта.
+                if user[c.ru_passport_number]: # на случай, если это инстранный (user[c.country]!='RU'), у него может не быть российского паспорта.
                     documents = [{
                             'identityCardType': 'RUSSIAN_PASSPORT',
-                            'cardNumber': self._camouflage('ru_cardNumber', user[10]),
-                            'issueDate': self._camouflage('ru_issueDate', user[11]), 
+                            'cardNumber': self._camouflage('ru_cardNumber', user[c.ru_passport_number]),
+                            'issueDate': self._camouflage('ru_issueDate', user[c.ru_passport_issued]), 
                             'country': _country,
-                            'placeOfBirth': self._camouflage('ru_placeOfBirth', user[12])
+                            'placeOfBirth': self._camouflage('ru_placeOfBirth', user[c.ru_place_of_birth])
                         }]
-                if user[13]: # Для иностранного (user[8]!='RU') или если есть инстранный паспорт
+                if user[c.en_passport_number]: # Для иностранного (user[c.country]!='RU') или если есть инстранный паспорт
                     documents += [{
                             'identityCardType': 'FOREIGN_PASSPORT',
-                            'cardNumber': self._camouflage('en_cardNumber', user[13]),
-                            'issueDate': self._camouflage('en_issueDate', user[14]),
-                            'expireDate': self._camouflage('en_expireDate', user[15]),
+                            'cardNumber': self._camouflage('en_cardNumber', user[c.en_passport_number]),
+                            'issueDate': self._camouflage('en_issueDate', user[c.en_passport_issued]),
+                            'expireDate': self._camouflage('en_expireDate', user[c.en_passport_expires]),
                             'country': _country
                         }]
                 #endregion Документы сотрудника
 
                 #region Объект служебной информации
                 service = {
-                    'unitName': user[18],
-                    'costName': str(user[19]),
-                    'position': user[17],
-                    'authorizators': [{'tabNum': self._camouflage('tabNum', user[20])}] if user[20] else [],
-                    'travelPolicy': user[23]
+                    'unitName': user[c.unit_name],
+                    'costName': str(user[c.cost_name]),
+                    'position': user[c.position],
+                    'authorizators': [{'tabNum': self._camouflage('tabNum', user[c.authorizer_tab_num])}] if user[c.authorizer_tab_num] else [],
+                    'travelPolicy': user[c.travel_policy]
                     }
                 #endregion Объект служебной информации выше
 
                 employee = {
-                    'tabNum': self._camouflage('tabNum', f'{user[1]:0>8}'),
-                    'birthday': self._camouflage('birthday', self._convdate(user[7])),
+                    'tabNum': self._camouflage('tabNum', f'{user[c.tab_num]:0>8}'),
+                    'birthday': self._camouflage('birthday', self._convdate(user[c.birthday])),
                     'citizenshipCode': _country,
-                    'gender': self._camouflage('gender', user[9]),
+                    'gender': self._camouflage('gender', user[c.gender]),
                     'names': names,
                     'documents': documents,
                     'service': service,
@@ -173,20 +472,57 @@ class TravelParser(DataParser):
                     employee['auth'] = auth
                 users_list_for_json.append(employee)
             except Exception as e:
-                user_except.append(f'{user[1]:0>8} - {str(e)}')
-
-        if len(user_except) > 1:
-            body_exception = '\r\n'.join((user_except))
-            self.logger.error(f'Ошибки при формировании employees_travel:\r\n {body_exception}')
+                report.add(f'{user[c.tab_num]:0>8} - {str(e)}', ValidationReport.ERROR)
 
         return users_list_for_json
 
-    def _travel_answer_analize(self, response_content) -> None:
+    def _travel_shard(self, list_users, terminated=(), columns=None) -> tuple:
+        """Формирование и сериализация части сотрудников (выполняется и в процессах формирования).
+
+        Args:
+            list_users (list): строки из БД
+            terminated (set): табельные номера уволенных сотрудников
+            columns (Columns): индексы полей строки
+
+        Returns:
+            tuple: список (tabNum, json сотрудника) и ошибки строк (ValidationReport)
+        """
+        report = ValidationReport()
+        employees = self._build_employees_travel(list_users, terminated, report, columns)
+        return [(employee['tabNum'], json.dumps(employee, ensure_ascii=False)) for employee in employees], report
+
+    def _travel_fragments(self, list_users: list, terminated=(), columns=None) -> list:
+        """Сотрудники компании в виде json-фрагментов. Большие компании (больше buildShardSize строк)
+        формируются частями в пуле процессов (settings.buildProcesses).
+
+        Args:
+            list_users (list): строки из БД
+            terminated (set): табельные номера уволенных сотрудников
+            columns (Columns): индексы полей строки
+
+        Returns:
+            list: (tabNum, json сотрудника) в порядке строк
+        """
+        process_pool = self._get_process_pool() if len(list_users) > self.shard_size else None
+        if process_pool:
+            shards = self._map_shards(process_pool, self._travel_shard, list_users, terminated, columns)
+        else:
+            shards = [self._travel_shard(list_users, terminated, columns)]
+        fragments, report = list(), ValidationReport()
+        for shard_fragments, shard_report in shards:
+            fragments += shard_fragments
+            report.merge(shard_report)
+        self._log_employees_errors(report)
+        return fragments
+
+    def _travel_answer_analize(self, response_content) -> tuple:
         """Анализ ответа от агентства.
 
         Args:
             response_content (Any): Значение content вернувшегося в Response от запроса
 
+        Returns:
+            tuple: признак общей ошибки обработки (пачка не принята) и множество табельных номеров сотрудников с ошибками
         """
         #region вспомогательные функции
         TYPES_FOR_ERROR = {'ERROR'} # ALL_TYPES={'ERROR', 'WARNING', 'INFO', 'SUCCESS'}
@@ -251,699 +587,514 @@ class TravelParser(DataParser):
         fatalError = response_content.get('fatalError')
         if fatalError:
             self.logger.error(f"Ответ содержит общую ошибку обработки: '{fatalError}'.")
+            return True, set()
         else:
             error_employees = list(filter(only_error_items, response_content['employees']))
             message_lines = make_message_lines(error_employees, TYPES_FOR_ERROR)
             if message_lines:
                 message_lines.insert(0, f"Результат анализа ошибочных записей, строк '{len(message_lines)}':")
                 self.logger.error('\n'.join(message_lines))
+            return False, {employee['tabNum'] for employee in error_employees}
                     
-    def travel_agent(self) -> None:
+    def travel_agent(self) -> list:
         """Основная функция обработки.\n
         Получения информации, подготовка, оправка запроса, получение ответа, анализ и выдача результата.
+
+        Returns:
+            list: результаты обработки по компаниям (CompanyResult)
         """
         agency = self.config.settings.CbtcTravelClick
         agency_name = 'CBTC Travel-Click'
         min_counter, procedure = agency.minCounter, agency.storedProc
 
         self.logger.info(f"Получение данных из БД для агентства '{agency_name}'")
-        employee_db_list = ConnectDB(self.config).fetch(procedure)
-        self.logger.info(f"Количество записей '{len(employee_db_list)}' получено из БД")
+        companies = agency.companies
+        # индекс строк по компаниям: строки читаются пачками и за один проход раскладываются по компаниям,
+        # в памяти остаются только сотрудники настроенных компаний
+        rows_by_company = {getattr(companies, company_key).id: [] for company_key in companies.keys()}
+        with ConnectDB(self.db_pool) as db:
+            db_rows = db.fetch_iter(procedure, layout=TRAVEL_LAYOUT, names=self._column_names(agency))
+            columns = db.columns or TRAVEL_LAYOUT.default
+            for row in db_rows:
+                company_rows = rows_by_company.get(row[columns.company_id])
+                if company_rows is not None:
+                    company_rows.append(row)
+        if db.error:
+            self.logger.error(f"Данные из БД для агентства '{agency_name}' получены не полностью, отправка отменена")
+            return []
+        company_rows_count = sum(len(company_rows) for company_rows in rows_by_company.values())
+        self.logger.info(f"Количество записей '{db.row_count}' получено из БД, из них '{company_rows_count}' по настроенным компаниям")
         if not self.config.is_debug_limit_off: # для debug игнорируем проверку на минимальный лимит по компании.
-            if (not employee_db_list) or (len(employee_db_list) < min_counter):
+            if db.row_count < min_counter:
                 self.logger.error(f"Количество сотрудников для агентства '{agency_name}' меньше {min_counter}")
-                return
+                return []
         else:
             self.logger.info(f"Включен флаг отладки, ограничение '{min_counter=}' игнорируется")
 
         proxy = Proxy(self.config)
+        snapshot = self._open_snapshot()
         self.logger.info(f"Цикл формирования json по компаниям для агентства '{agency_name}'")
-        companies = agency.companies
-        for company_key in companies.keys():
-            company = getattr(companies, company_key)
-            company_id = company.id
-            result_employees_list = []
-            self.logger.info(f"Формирование списка данных для '{company_key}' - '{company_id}'")
-            for row in employee_db_list:
-                if row[0] == company_id:
-                    result_employees_list.append(row)
-                    if self.config.is_debug_limit_off: # при включенном ключе отладки берем только 1 запись на компанию.
-                        self.logger.info(f"Включен флаг отладки, список '{company_id}' будет только с 1 записью")
-                        break
-            if result_employees_list == []: # если лист пуст
-                self.logger.warning(f"Пустой список данных для '{company_id}'!")
-                break
-            self.logger.info(f"Количество записей '{len(result_employees_list)}' сформировано для '{company_id}'")
+
+        def prepare(company_key) -> UploadJob:
+            company_rows = rows_by_company[getattr(companies, company_key).id]
+            return self._travel_prepare(agency, agency_name, company_key, company_rows, proxy, snapshot, columns)
+
+        results = self._process_companies(list(companies.keys()), prepare, proxy, snapshot)
+        proxy.close()
+        self._close_process_pool()
+        if snapshot:
+            snapshot.close()
+        self._log_summary(agency_name, results)
+        return results
+
+    def _travel_prepare(self, agency, agency_name, company_key, company_rows, proxy, snapshot, columns=None) -> UploadJob:
+        """Подготовка к отправке одной компании Тревел-Клик: сравнение со снимком и формирование списка сотрудников.
+
+        Args:
+            agency (Settings): секция агентства из settings.yaml
+            agency_name (str): имя агентства для лога
+            company_key (str): ключ компании в settings.yaml
+            company_rows (list): строки компании, полученные из БД
+            proxy (Proxy): отправщик запросов
+            snapshot (SnapshotStore): снимок для дельта-синхронизации или None
+            columns (Columns): индексы полей строки, по умолчанию позиции TRAVEL_LAYOUT
+
+        Returns:
+            UploadJob: компания с пачками json на отправку
+        """
+        columns = columns or TRAVEL_LAYOUT.default
+        company = getattr(agency.companies, company_key)
+        company_id = company.id
+        result = CompanyResult(company_key, company_id)
+        self.logger.info(f"Формирование списка данных для '{company_key}' - '{company_id}'")
+        result_employees_list = company_rows
+        if company_rows and self.config.is_debug_limit_off: # при включенном ключе отладки берем только 1 запись на компанию.
+            self.logger.info(f"Включен флаг отладки, список '{company_id}' будет только с 1 записью")
+            result_employees_list = company_rows[:1]
+        result.rows = len(result_employees_list)
+        if not result_employees_list: # если лист пуст
+            self.logger.warning(f"Пустой список данных для '{company_id}'!")
+            return UploadJob(result.finish(CompanyResult.SKIPPED, 'нет данных'))
+        self.logger.info(f"Количество записей '{len(result_employees_list)}' сформировано для '{company_id}'")
+        delta = None
+        if snapshot and str(company.fullUpdate).upper() != 'TRUE': # при полной выгрузке агентство ждет всех сотрудников
+            delta = snapshot.diff(Configuration.AGENCY_CBTC, company_key, result_employees_list, columns.tab_num)
+            if not delta:
+                self.logger.info(f"Изменений по сотрудникам '{company_id}' нет, отправка не требуется")
+                return UploadJob(result.finish(CompanyResult.NO_CHANGES))
+            result_employees_list = delta.rows
+        with stage_timings.measure('build') as span:
+            span.rows = len(result_employees_list)
+            employees = self._travel_fragments(result_employees_list, delta.terminated_keys if delta else (), columns)
+        batch_size = self._batch_size(agency, company)
+        if batch_size and str(company.fullUpdate).upper() == 'TRUE': # полная выгрузка по частям деактивирует остальных сотрудников
+            self.logger.warning(f"Для '{company_id}' включен fullUpdate, отправка пачками не используется")
+            batch_size = 0
+
+        headers = {"content-type": "application/json; charset=UTF-8"}
+        url, username, password = agency.url, agency.username, agency.decrypted_password
+        if self.config.is_debug_limit_off:
+            url, password = agency.travel_dev.url, agency.travel_dev.decrypted_password
+            self.logger.info('Включен флаг отладки, отправка данных идет на URL из travel_dev')
+        return UploadJob(result, agency_name, self._travel_batches(company, employees, batch_size, url, proxy,
+                                                                                skip_empty=bool(delta or batch_size)),
+                         url, headers, username, password, getattr(agency, 'compression', None), delta,
+                         require_content=True, analyze=self._travel_answer_analize)
+
+    def _travel_batches(self, company, employees: list, batch_size: int, url: str, proxy: Proxy, skip_empty: bool = False):
+        """Сборка json пачек из json-фрагментов сотрудников. Результат совпадает с json.dumps
+        для словаря компании со списком сотрудников.
+
+        Args:
+            company (Settings): секция компании из settings.yaml
+            employees (list): (tabNum, json сотрудника), подготовленные _travel_fragments
+            batch_size (int): размер пачки, 0 - все сотрудники одним запросом
+            url (str): адрес агентства, по нему выбирается адаптивный размер пачки
+            proxy (Proxy): отправщик запросов
+            skip_empty (bool): без пустой пачки, если сотрудников нет (дельта или отправка пачками)
+
+        Yields:
+            tuple: json пачки в байтах (None при ошибке сериализации) и список табельных номеров
+        """
+        start = 0
+        while start < len(employees) or not (start or skip_empty):
+            size = proxy.batch_size(url, batch_size) or len(employees) or 1 # размер пачки подстраивается под нагрузку агентства
+            batch, start = employees[start:start + size], start + size
             json_data = {
                 'company': str(company.id).strip(),
                 'confirm': company.confirm,
                 'fullUpdate': company.fullUpdate,
                 'incrementUpdate': company.incrementUpdate,
-                'employees': self._create_employees_travel(result_employees_list)
             }
-            try:
-                encoded_data = json.dumps(json_data, ensure_ascii=False).encode('utf-8')
-            except Exception as e:
-                self.logger.error(f'Ошибка преобразования json в байтстрим. Error: {str(e)}')
-            else:
-                self.logger.info(f"Отправка данных сотрудников '{company_id}' в агентство '{agency_name}'")
-                headers = {"content-type": "application/json; charset=UTF-8"}
-                url, username, password = agency.url, agency.username, agency.decrypted_password
-                if self.config.is_debug_limit_off:
-                    url, password = agency.travel_dev.url, agency.travel_dev.decrypted_password
-                    self.logger.info('Включен флаг отладки, отправка данных идет на URL из travel_dev')
-                response_content = proxy.send_data(url, headers, username, password, encoded_data)
-                if response_content: # обработка респонза от travel-click
-                    self._travel_answer_analize(response_content)
+            with stage_timings.measure('serialize') as span:
+                span.rows = len(batch)
+                try:
+                    head = json.dumps(json_data, ensure_ascii=False)[:-1] # список сотрудников - последний ключ
+                    encoded_data = f'{head}, "employees": [{", ".join(employee for _, employee in batch)}]}}'.encode('utf-8')
+                    span.bytes_out = len(encoded_data)
+                except Exception as e:
+                    self.logger.error(f'Ошибка преобразования json в байтстрим. Error: {str(e)}')
+                    encoded_data = None
+            yield encoded_data, [tab_num for tab_num, _ in batch]
 
 class AeroParser(DataParser):
     """Класс-холдер для работы с АэроТревел.
     """
-    def __init__(self, config: Configuration) -> None:
-        super().__init__(config)
-
-    def _create_profile_aero_xml(self, user):
-
-        profile = xml.Element(
-            "profile",
-            {
-                "uniqueIdentifier": self._camouflage('tabNum', f'{user[18]:0>8}'),  # tabnum
-                "companyUniqueIdentifier": "NESTLE_RUSSIA",
-            },
-        )
-
-        firstName = xml.Element("firstName")
-        firstName_ru = xml.SubElement(firstName, "russian")
-        firstName_ru.text = user[2]
-        firstName_en = xml.SubElement(firstName, "english")
-        firstName_en.text = user[5]
-
-        lastName = xml.Element("lastName")
-        lastName_ru = xml.SubElement(lastName, "russian")
-        lastName_ru.text = user[1]
-        lastName_en = xml.SubElement(lastName, "english")
-        lastName_en.text = user[4]
-
-        middleName = xml.Element("middleName")
-        middleName_ru = xml.SubElement(middleName, "russian")
-        middleName_ru.text = user[3]
-        middleName_en = xml.SubElement(middleName, "english")
-
-        gender = xml.Element("gender")
-        gender.text = self._camouflage('gender', 'Male' if user[6] == 'm' else 'Female')
-
-        dateOfBirth = xml.Element("dateOfBirth")
-        _birthday = self._camouflage('birthday', user[7]) # Дата Рождения
-        dateOfBirth.text = self._convdate(_birthday)
-
-        dateOfTermination = xml.Element("dateOfTermination", {"xsi:nil": "true"})
-
-        analytics = xml.Element(
-            "analytics",
-            {
-                "xmlns:xs": "http://www.w3.org/2001/XMLSchema",
-                "xmlns": "http://integration.aeroclub.ru/hub/schemas/profiles",
-            },
-        )
-
-        properties = xml.Element(
-            "properties",
-            {
-                "xmlns:xs": "http://www.w3.org/2001/XMLSchema",
-                "xmlns": "http://integration.aeroclub.ru/hub/schemas/profiles",
-            },
-        )
-
-        #region Начало доп полей
-
-        property1 = xml.Element(
-            "property",
-            {
-                "xmlns:xs": "http://www.w3.org/2001/XMLSchema",
-                "xmlns": "http://integration.aeroclub.ru/hub/schemas/profiles",
-            },
-        )
-
-        identifier = xml.SubElement(property1, "identifier")
-        identifier.text = "Employee ID"
-        value = xml.SubElement(property1, "value")
-        value.text = self._camouflage('tabNum', f'{user[18]:0>8}')  # tabnum
-
-        properties.append(property1)
-
-        property2 = xml.Element(
-            "property",
-            {
-                "xmlns:xs": "http://www.w3.org/2001/XMLSchema",
-                "xmlns": "http://integration.aeroclub.ru/hub/schemas/profiles",
-            },
-        )
-
-        identifier = xml.SubElement(property2, "identifier")
-        identifier.text = "GRADE"
-        value = xml.SubElement(property2, "value")
-        value.text = str(user[19])
-
-        properties.append(property2)
-
-        property3 = xml.Element(
-            "property",
-            {
-                "xmlns:xs": "http://www.w3.org/2001/XMLSchema",
-                "xmlns": "http://integration.aeroclub.ru/hub/schemas/profiles",
-            },
-        )
-
-        identifier = xml.SubElement(property3, "identifier")
-        identifier.text = "Position"
-        value = xml.SubElement(property3, "value")
-        value.text = user[20]
-
-        properties.append(property3)
-
-        property4 = xml.Element(
-            "property",
-            {
-                "xmlns:xs": "http://www.w3.org/2001/XMLSchema",
-                "xmlns": "http://integration.aeroclub.ru/hub/schemas/profiles",
-            },
-        )
-
-        identifier = xml.SubElement(property4, "identifier")
-        identifier.text = "Department"
-        value = xml.SubElement(property4, "value")
-        value.text = user[21]
-
-        properties.append(property4)
-
-        property5 = xml.Element(
-            "property",
-            {
-                "xmlns:xs": "http://www.w3.org/2001/XMLSchema",
-                "xmlns": "http://integration.aeroclub.ru/hub/schemas/profiles",
-            },
-        )
-
-        identifier = xml.SubElement(property5, "identifier")
-        identifier.text = "Structural division"
-        value = xml.SubElement(property5, "value")
-        value.text = user[22]
-
-        properties.append(property5)
-
-        property6 = xml.Element(
-            "property",
-            {
-                "xmlns:xs": "http://www.w3.org/2001/XMLSchema",
-                "xmlns": "http://integration.aeroclub.ru/hub/schemas/profiles",
-            },
-        )
-
-        identifier = xml.SubElement(property6, "identifier")
-        identifier.text = "Cost Center"
-        value = xml.SubElement(property6, "value")
-        value.text = user[23]
-
-        properties.append(property6)
-
-        property7 = xml.Element(
-            "property",
-            {
-                "xmlns:xs": "http://www.w3.org/2001/XMLSchema",
-                "xmlns": "http://integration.aeroclub.ru/hub/schemas/profiles",
-            },
-        )
-
-        identifier = xml.SubElement(property7, "identifier")
-        identifier.text = "Line manager email"
-        value = xml.SubElement(property7, "value")
-        value.text = self._camouflage('other_email', user[24])
-
-        properties.append(property7)
-
-        #endregion Конец создания доп полей
-
-        analytics.append(properties)
-
-        contacts = xml.Element(
-            "contacts",
-            {
-                "xmlns:xs": "http://www.w3.org/2001/XMLSchema",
-                "xmlns": "http://integration.aeroclub.ru/hub/schemas/profiles",
-            },
-        )
-        emailAddress = xml.Element(
-            "emailAddress",
-            {
-                "xmlns:xs": "http://www.w3.org/2001/XMLSchema",
-                "xmlns": "http://integration.aeroclub.ru/hub/schemas/profiles",
-                "kind": "Work",
-            },
-        )
-
-        address = xml.SubElement(emailAddress, "address")
-        address.text = user[17]
-#        print(user[17])
-        contacts.append(emailAddress)
-
-        documents = xml.Element(
-            "documents",
-            {
-                "xmlns:xs": "http://www.w3.org/2001/XMLSchema",
-                "xmlns": "http://integration.aeroclub.ru/hub/schemas/profiles",
-            },
-        )
-
-        document = xml.Element(
-            "document",
-            {
-                "xmlns:xsi": "http://www.w3.org/2001/XMLSchema-instance",
-                "xmlns:xs": "http://www.w3.org/2001/XMLSchema",
-                "xmlns": "http://integration.aeroclub.ru/hub/schemas/profiles",
-                "type": "NationalPassport",
-            },
-        )
-
-        series = xml.SubElement(document, "series")
-        series.text = user[13] if (user[13] is not None and len(user[13]) > 0) else user[8]
-
-        number = xml.SubElement(document, "number")
-        number.text = user[14] if (user[14] is not None and len(user[14]) > 0) else user[9]
-
-        issuedOn = xml.SubElement(document, "issuedOn")
-        _issuedOn = user[15] if (user[15] is not None and len(user[15]) > 0) else user[10]
-        issuedOn.text = self._convdate(_issuedOn)
-
-        if user[16] is not None and user[16] != "":
-            expiresOn = xml.SubElement(document, "expiresOn")
-            expiresOn.text = self._convdate(user[16])
-        else:
-            expiresOn = xml.SubElement(document, "expiresOn", {"xsi:nil": "true"})
-        #print(user[16])
-
-        placeOfBirth = xml.SubElement(document, "placeOfBirth")
-        placeOfBirth.text = user[11]
-
-        firstName_doc = xml.SubElement(document, "firstName")
-        firstName_doc.text = user[2]
-
-        lastName_doc = xml.SubElement(document, "lastName")
-        lastName_doc.text = user[1]
-
-        citizenship = xml.SubElement(document, "citizenship")
-        code = xml.SubElement(citizenship, "code")
-        iso_attr = xml.SubElement(code, "iso3611-a2")
-        iso_attr.text = user[12] if (user[12] is not None and len(user[12]) > 0) else "RU"
-        # citizenship.append(iso_attr)
-        documents.append(document)
-
-        profile.append(firstName)
-        profile.append(middleName)
-        profile.append(lastName)
-        profile.append(gender)
-        profile.append(dateOfBirth)
-        # profile.append(dateOfEmployment)
-        profile.append(dateOfTermination)
-        profile.append(analytics)
-        profile.append(contacts)
-        profile.append(documents)
-        return profile
-
-    def _create_profile_aero_xml_db(self, user, companyUniqueIdentifier):
-
-        if user[8] is None:
-            raise Exception("Problem with bithday")
-
-        if user[7] is None:
-            raise Exception("Problem with male")
-
-        if user[6] is None:
-            raise Exception("Problem with national")
-
-        if user[22] is None or user[23] is None or user[24] is None or user[25] is None:
-            raise Exception("Problem with org structure")
-        profile = xml.Element(
-            "profile",
-            {
-                "uniqueIdentifier": f'{user[21]:0>8}',  # tabnum
-                "companyUniqueIdentifier": companyUniqueIdentifier,
-            },
-        )
-
-        firstName = xml.Element("firstName")
-        firstName_ru = xml.SubElement(firstName, "russian")
-        firstName_ru.text = self._camouflage('ru_name', user[2])
-        firstName_en = xml.SubElement(firstName, "english")
-        firstName_en.text = self._camouflage('en_name', user[5])
-
-        lastName = xml.Element("lastName")
-        lastName_ru = xml.SubElement(lastName, "russian")
-        lastName_ru.text = self._camouflage('ru_surname', user[1])
-        lastName_en = xml.SubElement(lastName, "english")
-        lastName_en.text = self._camouflage('en_surname', user[4])
-
-        middleName = xml.Element("middleName")
-        middleName_ru = xml.SubElement(middleName, "russian")
-        middleName_ru.text = self._camouflage('en_middleName', user[3])
-        middleName_en = xml.SubElement(middleName, "english")
-
-        gender = xml.Element("gender")
-        gender.text = self._camouflage('gender', 'Male' if user[7] == 'm' else 'Female')
-
-        dateOfBirth = xml.Element("dateOfBirth")
-        dateOfBirth.text = self._camouflage('birthday', self._convdate(user[8]))
-
-        dateOfTermination = xml.Element("dateOfTermination", {"xsi:nil": "true"})
-
-        analytics = xml.Element(
-            "analytics",
-            {
-                "xmlns:xs": "http://www.w3.org/2001/XMLSchema",
-                "xmlns": "http://integration.aeroclub.ru/hub/schemas/profiles",
-            },
-        )
-
-        properties = xml.Element(
-            "properties",
-            {
-                "xmlns:xs": "http://www.w3.org/2001/XMLSchema",
-                "xmlns": "http://integration.aeroclub.ru/hub/schemas/profiles",
-            },
-        )
-
-        #region Создание доп. полей
-        property1 = xml.Element(
-            "property",
-            {
-                "xmlns:xs": "http://www.w3.org/2001/XMLSchema",
-                "xmlns": "http://integration.aeroclub.ru/hub/schemas/profiles",
-            },
-        )
-
-        identifier = xml.SubElement(property1, "identifier")
-        identifier.text = "Employee ID"
-        value = xml.SubElement(property1, "value")
-        value.text = self._camouflage('tabNum', f'{user[21]:0>8}') # tabnum
+    def __init__(self, config: Configuration, db_pool: ConnectionPool) -> None:
+        super().__init__(config, db_pool)
+        self.full_template = AeroProfileTemplate()
+        # компактный xml (AeroClub.compactXml): пространства имен объявлены только в корне
+        compact = bool(getattr(config.settings.AeroClub, 'compactXml', False))
+        self.profile_template = AeroProfileTemplate(compact=True) if compact else self.full_template
 
-        properties.append(property1)
+    def _create_profile_aero_xml(self, user, columns=None) -> bytes:
+        """Формирование профиля по строке старого формата выгрузки.
 
-        property2 = xml.Element(
-            "property",
-            {
-                "xmlns:xs": "http://www.w3.org/2001/XMLSchema",
-                "xmlns": "http://integration.aeroclub.ru/hub/schemas/profiles",
-            },
-        )
-
-        identifier = xml.SubElement(property2, "identifier")
-        identifier.text = "GRADE"
-        value = xml.SubElement(property2, "value")
-        value.text = str(user[22])
-
-        properties.append(property2)
-
-        property3 = xml.Element(
-            "property",
-            {
-                "xmlns:xs": "http://www.w3.org/2001/XMLSchema",
-                "xmlns": "http://integration.aeroclub.ru/hub/schemas/profiles",
-            },
-        )
-
-        identifier = xml.SubElement(property3, "identifier")
-        identifier.text = "Position"
-        value = xml.SubElement(property3, "value")
-        value.text = user[23]
-
-        properties.append(property3)
-
-        property4 = xml.Element(
-            "property",
-            {
-                "xmlns:xs": "http://www.w3.org/2001/XMLSchema",
-                "xmlns": "http://integration.aeroclub.ru/hub/schemas/profiles",
-            },
-        )
-
-        identifier = xml.SubElement(property4, "identifier")
-        identifier.text = "Department"
-        value = xml.SubElement(property4, "value")
-        value.text = user[24]
-
-        properties.append(property4)
+        Args:
+            user (tuple): строка выгрузки
+            columns (Columns): индексы полей строки, по умолчанию позиции AERO_LEGACY_LAYOUT
 
-        property5 = xml.Element(
-            "property",
-            {
-                "xmlns:xs": "http://www.w3.org/2001/XMLSchema",
-                "xmlns": "http://integration.aeroclub.ru/hub/schemas/profiles",
-            },
+        Returns:
+            bytes: xml профиля
+        """
+        c = columns or AERO_LEGACY_LAYOUT.default
+        tab_num = self._camouflage('tabNum', f'{user[c.tab_num]:0>8}')  # tabnum
+        _birthday = self._camouflage('birthday', user[c.birthday]) # Дата Рождения
+        properties = (
+            tab_num,
+            str(user[c.grade]),
+            user[c.position],
+            user[c.department],
+            user[c.division],
+            user[c.cost_center],
+            self._camouflage('other_email', user[c.manager_email]),
         )
-
-        identifier = xml.SubElement(property5, "identifier")
-        identifier.text = "Structural division"
-        value = xml.SubElement(property5, "value")
-        value.text = user[25]
-
-        properties.append(property5)
-
-        property6 = xml.Element(
-            "property",
-            {
-                "xmlns:xs": "http://www.w3.org/2001/XMLSchema",
-                "xmlns": "http://integration.aeroclub.ru/hub/schemas/profiles",
-            },
+        _issuedOn = user[c.passport_issued] if (user[c.passport_issued] is not None and len(user[c.passport_issued]) > 0) else user[c.ru_passport_issued]
+        document = (
+            'NationalPassport',
+            user[c.passport_series] if (user[c.passport_series] is not None and len(user[c.passport_series]) > 0) else user[c.ru_passport_series], # series
+            user[c.passport_number] if (user[c.passport_number] is not None and len(user[c.passport_number]) > 0) else user[c.ru_passport_number], # number
+            self._convdate(_issuedOn),
+            self._convdate(user[c.passport_expires]) if user[c.passport_expires] is not None and user[c.passport_expires] != "" else None, # expiresOn
+            user[c.place_of_birth], # placeOfBirth
+            user[c.ru_name],
+            user[c.ru_surname],
+            user[c.citizenship] if (user[c.citizenship] is not None and len(user[c.citizenship]) > 0) else "RU",
         )
-
-        identifier = xml.SubElement(property6, "identifier")
-        identifier.text = "Cost Center"
-        value = xml.SubElement(property6, "value")
-        value.text = user[26]
-
-        properties.append(property6)
-
-        property7 = xml.Element(
-            "property",
-            {
-                "xmlns:xs": "http://www.w3.org/2001/XMLSchema",
-                "xmlns": "http://integration.aeroclub.ru/hub/schemas/profiles",
-            },
+        return self.profile_template.render(
+            tab_num, 'NESTLE_RUSSIA',
+            (user[c.ru_name], user[c.en_name]),
+            (user[c.ru_surname], user[c.en_surname]),
+            user[c.ru_middle_name],
+            self._camouflage('gender', 'Male' if user[c.gender] == 'm' else 'Female'),
+            self._convdate(_birthday),
+            None,
+            properties,
+            user[c.email],
+            document,
         )
 
-        identifier = xml.SubElement(property7, "identifier")
-        identifier.text = "Line manager email"
-        value = xml.SubElement(property7, "value")
-        value.text = self._camouflage('other_email', user[28])
-
-        properties.append(property7)
+    def _create_profile_aero_xml_db(self, user, companyUniqueIdentifier, date_of_termination=None, template=None, columns=None, validate=True) -> bytes:
+        """Формирование профиля по строке выгрузки хранимой процедуры с проверкой заполнения.
 
-        #endregion Конец создания доп полей
-
-        analytics.append(properties)
+        Args:
+            user (tuple): строка выгрузки
+            companyUniqueIdentifier (str): идентификатор компании в агентстве
+            date_of_termination (str): дата увольнения (для уволенных сотрудников)
+            template (AeroProfileTemplate): шаблон профиля, по умолчанию profile_template
+            columns (Columns): индексы полей строки, по умолчанию позиции AERO_LAYOUT
+            validate (Callable | bool): проверка строки - предикат AERO_RULES.compile(columns), скомпилированный один раз
+                на набор строк; True - компиляция при каждом вызове, False - строка уже проверена
 
-        contacts = xml.Element(
-            "contacts",
-            {
-                "xmlns:xs": "http://www.w3.org/2001/XMLSchema",
-                "xmlns": "http://integration.aeroclub.ru/hub/schemas/profiles",
-            },
-        )
-        emailAddress = xml.Element(
-            "emailAddress",
-            {
-                "xmlns:xs": "http://www.w3.org/2001/XMLSchema",
-                "xmlns": "http://integration.aeroclub.ru/hub/schemas/profiles",
-                "kind": "Work",
-            },
+        Returns:
+            bytes: xml профиля
+        """
+        c = columns or AERO_LAYOUT.default
+        if validate:
+            rule = (AERO_RULES.compile(c) if validate is True else validate)(user)
+            if rule is not None:
+                raise Exception(rule.message)
+
+        first_name = (self._camouflage('ru_name', user[c.ru_name]), self._camouflage('en_name', user[c.en_name]))
+        last_name = (self._camouflage('ru_surname', user[c.ru_surname]), self._camouflage('en_surname', user[c.en_surname]))
+        middle_name = self._camouflage('en_middleName', user[c.ru_middle_name])
+        gender = self._camouflage('gender', 'Male' if user[c.gender] == 'm' else 'Female')
+        birthday = self._camouflage('birthday', self._convdate(user[c.birthday]))
+
+        #region Доп. поля
+        properties = (
+            self._camouflage('tabNum', f'{user[c.tab_num]:0>8}'), # tabnum
+            str(user[c.grade]),
+            user[c.position],
+            user[c.department],
+            user[c.division],
+            user[c.cost_center],
+            self._camouflage('other_email', user[c.manager_email]),
         )
-
-        address = xml.SubElement(emailAddress, "address")
-        address.text = self._camouflage('email', user[20])
-        contacts.append(emailAddress)
+        #endregion Доп. поля
+        email = self._camouflage('email', user[c.email])
 
         #region Паспорта
-        if user[6] != "RU":
-            if user[16] is not None and user[14] is not None and user[15] is not None:
-
-                documents = xml.Element(
-                    "documents",
-                    {
-                        "xmlns:xs": "http://www.w3.org/2001/XMLSchema",
-                        "xmlns": "http://integration.aeroclub.ru/hub/schemas/profiles",
-                    },
+        document = None
+        if user[c.citizenship] != "RU":
+            if user[c.en_passport_issued] is not None and user[c.en_passport_series] is not None and user[c.en_passport_number] is not None:
+                document = (
+                    'InternationalPassport',
+                    user[c.en_passport_series],
+                    self._camouflage('en_cardNumber', user[c.en_passport_number]),
+                    self._convdate(user[c.en_passport_issued]),
+                    self._convdate(user[c.en_passport_expires]) if user[c.en_passport_expires] is not None and len(user[c.en_passport_expires]) > 2 else None, # expiresOn
+                    None, # placeOfBirth
+                    self._camouflage('en_name', user[c.en_name]),
+                    self._camouflage('en_surname', user[c.en_surname]),
+                    user[c.citizenship],
                 )
-
-                document = xml.Element(
-                    "document",
-                    {
-                        "xmlns:xsi": "http://www.w3.org/2001/XMLSchema-instance",
-                        "xmlns:xs": "http://www.w3.org/2001/XMLSchema",
-                        "xmlns": "http://integration.aeroclub.ru/hub/schemas/profiles",
-                        "type": "InternationalPassport",
-                    },
-                )
-
-                series = xml.SubElement(document, "series")
-                series.text = user[14]
-
-                number = xml.SubElement(document, "number")
-                number.text = self._camouflage('en_cardNumber', user[15])
-
-                issuedOn = xml.SubElement(document, "issuedOn")
-                issuedOn.text = self._convdate(user[16])
-
-                if user[17] is not None and len(user[17]) > 2:
-                    expiresOn = xml.SubElement(document, "expiresOn")
-                    expiresOn.text = self._convdate(user[17])
-                else:
-                    expiresOn = xml.SubElement(document, "expiresOn", {"xsi:nil": "true"})
-                placeOfBirth = xml.SubElement(document, "placeOfBirth")
-
-                firstName_doc = xml.SubElement(document, "firstName")
-                firstName_doc.text = self._camouflage('en_name', user[5])
-
-                lastName_doc = xml.SubElement(document, "lastName")
-                lastName_doc.text = self._camouflage('en_surname', user[4])
-
-                citizenship = xml.SubElement(document, "citizenship")
-                code = xml.SubElement(citizenship, "code")
-                iso_attr = xml.SubElement(code, "iso3611-a2")
-                iso_attr.text = user[6]
         else:
-
-            if user[9] is not None and user[10] is not None and user[11] is not None:
-
-                documents = xml.Element(
-                    "documents",
-                    {
-                        "xmlns:xs": "http://www.w3.org/2001/XMLSchema",
-                        "xmlns": "http://integration.aeroclub.ru/hub/schemas/profiles",
-                    },
-                )
-
-                document = xml.Element(
-                    "document",
-                    {
-                        "xmlns:xsi": "http://www.w3.org/2001/XMLSchema-instance",
-                        "xmlns:xs": "http://www.w3.org/2001/XMLSchema",
-                        "xmlns": "http://integration.aeroclub.ru/hub/schemas/profiles",
-                        "type": "NationalPassport",
-                    },
+            if user[c.ru_passport_series] is not None and user[c.ru_passport_number] is not None and user[c.ru_passport_issued] is not None:
+                document = (
+                    'NationalPassport',
+                    user[c.ru_passport_series],
+                    self._camouflage('ru_cardNumber', user[c.ru_passport_number]),
+                    self._convdate(user[c.ru_passport_issued]),
+                    None, # expiresOn
+                    None, # placeOfBirth
+                    self._camouflage('ru_name', user[c.ru_name]),
+                    self._camouflage('ru_surname', user[c.ru_surname]),
+                    user[c.citizenship],
                 )
+        #endregion Паспорта
 
-                series = xml.SubElement(document, "series")
-                series.text = user[9]
-
-                number = xml.SubElement(document, "number")
-                number.text = self._camouflage('ru_cardNumber', user[10])
-
-                issuedOn = xml.SubElement(document, "issuedOn")
-                issuedOn.text = self._convdate(user[11])
-
-                expiresOn = xml.SubElement(document, "expiresOn", {"xsi:nil": "true"})
-
-                placeOfBirth = xml.SubElement(document, "placeOfBirth")
-
-                firstName_doc = xml.SubElement(document, "firstName")
-                firstName_doc.text = self._camouflage('ru_name', user[2])
+        return (template or self.profile_template).render(
+            f'{user[c.tab_num]:0>8}', # tabnum
+            companyUniqueIdentifier,
+            first_name, last_name, middle_name, gender, birthday,
+            date_of_termination,
+            properties,
+            email,
+            document,
+        )
 
-                lastName_doc = xml.SubElement(document, "lastName")
-                lastName_doc.text = self._camouflage('ru_surname', user[1])
+    def _createXML_aero(self, list_aero, company, terminated=(), columns=None):
+        """Создаем XML файл.
 
-                citizenship = xml.SubElement(document, "citizenship")
-                code = xml.SubElement(citizenship, "code")
-                iso_attr = xml.SubElement(code, "iso3611-a2")
-                iso_attr.text = user[6]
+        Args:
+            list_aero (Iterable): сотрудники, полученные из БД (список или генератор ConnectDB.fetch_iter).
+            company (str): идентификатор компании в агентстве.
+            terminated (set): табельные номера уволенных сотрудников, им проставляется dateOfTermination.
+            columns (Columns): индексы полей строки, по умолчанию позиции AERO_LAYOUT.
 
-        try:
-            if document is not None:
-                documents.append(document)
-        except:
-            pass
-        #endregion Паспорта
+        Returns:
+            tuple: xml в байтах и количество профилей в нем
+        """
+        xml_data, tab_nums = next(self._createXML_aero_batches(list_aero, company, terminated, columns=columns))
+        return xml_data, len(tab_nums)
 
-        profile.append(firstName)
-        profile.append(middleName)
-        profile.append(lastName)
-        profile.append(gender)
-        profile.append(dateOfBirth)
-        profile.append(dateOfTermination)
-        profile.append(analytics)
-        profile.append(contacts)
-        try:
-            if document is not None:
-                profile.append(documents)
-        except:
-            pass
-
-        return profile
-
-    def _createXML_aero(self, list_aero, company):
-        """Создаем XML файл."""
-
-        profiles = xml.Element(
-            'profiles',
-            {
-                'xmlns:xsi': 'http://www.w3.org/2001/XMLSchema-instance',
-                'xmlns:xs': 'http://www.w3.org/2001/XMLSchema',
-                'xmlns': 'http://integration.aeroclub.ru/hub/schemas/profiles',
-            },
-        )
+    def _createXML_aero_batches(self, list_aero, company, terminated=(), batch_size=0, columns=None, skip_empty=False):
+        """Создаем XML файлы пачками по batch_size профилей.\n
+        Каждый profile формируется по скомпилированному шаблону и дописывается в буфер пачки, дерево всей компании в памяти не держится.
+        Без разбиения (batch_size=0) результат побайтно совпадает с xml.tostring для дерева profiles.
 
-        user_except = list()
-        for row in list_aero:
+        Args:
+            list_aero (Iterable): сотрудники, полученные из БД (список или генератор ConnectDB.fetch_iter).
+            company (str): идентификатор компании в агентстве.
+            terminated (set): табельные номера уволенных сотрудников, им проставляется dateOfTermination.
+            batch_size (int | Callable): количество профилей в пачке (или функция, возвращающая его перед каждой пачкой), 0 - все профили одним xml.
+            columns (Columns): индексы полей строки, по умолчанию позиции AERO_LAYOUT.
+            skip_empty (bool): без пустого xml, если ни одного профиля не сформировано (дельта или отправка пачками).
+
+        Yields:
+            tuple: xml пачки в байтах и список табельных номеров ее профилей
+        """
+        next_size = batch_size if callable(batch_size) else lambda: batch_size
+        size = next_size()
+        buffer = io.BytesIO()
+        tab_nums, profiles_count = list(), 0
+        report = ValidationReport()
+        for tab_num, profile, template in self._render_aero_profiles(list_aero, company, terminated, report, columns):
+            if not tab_nums: # открывающий тег корня пишется перед первым профилем пачки
+                buffer.write(template.profiles_open)
+            buffer.write(profile)
+            tab_nums.append(tab_num)
+            profiles_count += 1
+            if self.config.is_debug_limit_off: # при включенном отладочном параметре список будет только с 1 записью.
+                self.logger.info('Включен флаг отладки, список будет только с 1 записью.')
+                break
+            if size and len(tab_nums) >= size:
+                buffer.write(template.profiles_close)
+                yield buffer.getvalue(), tab_nums
+                buffer, tab_nums, size = io.BytesIO(), list(), next_size()
+
+        if report:
+            body_exception = "\r\n".join(report.errors)
+            self.logger.error(f'Ошибки при формировании XML для AeroClub ({report.summary()}): \r\n {body_exception}')
+
+        if tab_nums or not (profiles_count or skip_empty):
+            template = template if profiles_count else self.profile_template
+            buffer.write(template.profiles_close if tab_nums else template.profiles_empty)
+            yield buffer.getvalue(), tab_nums
+
+    def _render_aero_rows(self, rows, company, terminated, today, template, columns, report: ValidationReport):
+        """Профили строк выгрузки. Строки проверяются правилами AERO_RULES без исключений,
+        нарушения и непредвиденные ошибки формирования накапливаются в report.
+
+        Yields:
+            tuple: строка, табельный номер и xml профиля
+        """
+        validate = AERO_RULES.compile(columns)
+        for row in rows:
+            tab_num = f'{row[columns.tab_num]:0>8}'
+            rule = validate(row)
+            if rule is not None:
+                report.add(f'{tab_num} {rule.message}', rule.code)
+                continue
+            date_of_termination = today if tab_num in terminated else None
             try:
-                profile = self._create_profile_aero_xml_db(row, company)
-                profiles.append(profile)
-                if self.config.is_debug_limit_off: # при включенном отладочном параметре список будет только с 1 записью.
-                    self.logger.info('Включен флаг отладки, список будет только с 1 записью.')
-                    break
+                profile = self._create_profile_aero_xml_db(row, company, date_of_termination, template, columns, validate=False)
             except Exception as e:
-                user_except.append(f'{row[21]:0>8} {str(e)}')
+                report.add(f'{tab_num} {str(e)}', ValidationReport.ERROR)
+                continue
+            yield row, tab_num, profile
 
-        if len(user_except) > 1:
-            body_exception = "\r\n".join((user_except))
-            self.logger.error(f'Ошибки при формировании XML для AeroClub: \r\n {body_exception}')
+    def _render_aero_shard(self, rows, company, terminated, today, compact, columns) -> tuple:
+        """Формирование профилей части выгрузки в процессе формирования.
+
+        Returns:
+            tuple: список (табельный номер, xml профиля) и ошибки строк (ValidationReport)
+        """
+        template = self.profile_template if compact else self.full_template
+        report = ValidationReport()
+        profiles = [(tab_num, profile) for _, tab_num, profile in self._render_aero_rows(rows, company, terminated, today, template, columns, report)]
+        return profiles, report
 
-        tree = xml.tostring(profiles)
-        return tree
+    def _render_aero_profiles(self, list_aero, company, terminated, report: ValidationReport, columns=None):
+        """Профили в порядке строк выгрузки. Первый профиль формируется в основном процессе и при компактном формате
+        сверяется с полным, остальные - в основном процессе или частями в пуле процессов (settings.buildProcesses).
 
-    def aero_agent(self) -> None:
+        Args:
+            list_aero (Iterable): сотрудники, полученные из БД.
+            company (str): идентификатор компании в агентстве.
+            terminated (set): табельные номера уволенных сотрудников.
+            report (ValidationReport): ошибки строк.
+            columns (Columns): индексы полей строки, по умолчанию позиции AERO_LAYOUT.
+
+        Yields:
+            tuple: табельный номер, xml профиля и шаблон, по которому он сформирован
+        """
+        columns = columns or AERO_LAYOUT.default
+        template = self.profile_template
+        today = datetime.now().strftime('%Y-%m-%d')
+        rows = iter(list_aero)
+        for row, tab_num, profile in self._render_aero_rows(rows, company, terminated, today, template, columns, report):
+            if template.compact: # компактный формат сверяется с полным на первом профиле
+                date_of_termination = today if tab_num in terminated else None
+                full_profile = self._create_profile_aero_xml_db(row, company, date_of_termination, self.full_template, columns, validate=False)
+                if not AeroProfileTemplate.is_equivalent(self.full_template.document(full_profile), template.document(profile)):
+                    self.logger.error('Компактный xml не эквивалентен полному, используется полный формат.')
+                    template, profile = self.full_template, full_profile
+            yield tab_num, profile, template
+            break
+
+        process_pool = self._get_process_pool()
+        if process_pool:
+            for profiles, shard_report in self._map_shards(process_pool, self._render_aero_shard, rows, company, terminated, today, template.compact, columns):
+                report.merge(shard_report)
+                for tab_num, profile in profiles:
+                    yield tab_num, profile, template
+            return
+        for _, tab_num, profile in self._render_aero_rows(rows, company, terminated, today, template, columns, report):
+            yield tab_num, profile, template
+
+    def aero_agent(self) -> list:
         """Основная функция обработки.\n
         Получения информации, подготовка, оправка запроса, получение ответа, анализ и выдача результата.
+
+        Returns:
+            list: результаты обработки по компаниям (CompanyResult)
         """
         agency = self.config.settings.AeroClub
         agency_name = 'AeroClub'
         companies = agency.companies
 
         proxy = Proxy(self.config)
-        for company_name in companies.keys():
-            company = getattr(companies, company_name)
-            company_id = company.id
-            min_counter, procedure = company.minCounter, company.storedProc
-
-            self.logger.info(f"Обращение к хранимой процедуре: '{procedure}' для компании '{company_id}'")
-            employee_db_list = ConnectDB(self.config).fetch(procedure)
-            self.logger.info(f"Количество записей '{len(employee_db_list)}' получено из БД.")
-            if not self.config.is_debug_limit_off: # игнорируем минимальный лимит по компании 
-                if (not employee_db_list) or (len(employee_db_list) < min_counter):
-                    self.logger.error(f"Количество сотрудников для компании '{company_id}' в агентстве '{agency_name}' меньше {min_counter}")
-                    continue
+        snapshot = self._open_snapshot()
+
+        def prepare(company_name) -> UploadJob:
+            return self._aero_prepare(agency, agency_name, company_name, proxy, snapshot)
+
+        results = self._process_companies(list(companies.keys()), prepare, proxy, snapshot)
+        proxy.close()
+        self._close_process_pool()
+        if snapshot:
+            snapshot.close()
+        self._log_summary(agency_name, results)
+        return results
+
+    def _aero_prepare(self, agency, agency_name, company_name, proxy, snapshot) -> UploadJob:
+        """Получение данных и подготовка к отправке одной компании АэроКлуб.\n
+        В конвейерном режиме строки читаются из БД целиком и соединение сразу возвращается в пул, xml пачек формируется
+        на стадии формирования. Иначе xml формируется по мере чтения строк из БД.
+
+        Args:
+            agency (Settings): секция агентства из settings.yaml
+            agency_name (str): имя агентства для лога
+            company_name (str): ключ компании в settings.yaml
+            proxy (Proxy): отправщик запросов
+            snapshot (SnapshotStore): снимок для дельта-синхронизации или None
+
+        Returns:
+            UploadJob: компания с пачками xml на отправку
+        """
+        company = getattr(agency.companies, company_name)
+        company_id = company.id
+        result = CompanyResult(company_name, company_id)
+        min_counter, procedure = company.minCounter, company.storedProc
+
+        batch_size = self._batch_size(agency, company)
+        next_size = lambda: proxy.batch_size(agency.url, batch_size) # размер следующей пачки подстраивается под нагрузку агентства
+
+        self.logger.info(f"Обращение к хранимой процедуре: '{procedure}' для компании '{company_id}'")
+        delta, batches = None, None
+        with ConnectDB(self.db_pool) as db:
+            # строки читаются из БД пачками по мере формирования
+            employee_db_rows = db.fetch_iter(procedure, layout=AERO_LAYOUT, names=self._column_names(agency, company))
+            columns = db.columns or AERO_LAYOUT.default
+            if snapshot:
+                delta = snapshot.diff(Configuration.AGENCY_AERO, company_name, employee_db_rows, columns.tab_num)
+            elif self.config.is_pipeline:
+                employee_db_rows = [tuple(row) for row in employee_db_rows]
+                batches = stage_timings.iterate('build', self._createXML_aero_batches(employee_db_rows, company_id, (), next_size, columns,
+                                                                                        skip_empty=bool(batch_size)))
             else:
-                self.logger.info(f"Включен флаг отладки - ограничение '{min_counter}' игнорируется.")
+                self.logger.info(f"Формирование xml для '{company_id}' в агентстве '{agency_name}'")
+                batches = list(stage_timings.iterate('build', self._createXML_aero_batches(employee_db_rows, company_id, (), batch_size, columns,
+                                                                                             skip_empty=bool(batch_size))))
+        result.rows = db.row_count
+        if db.error:
+            self.logger.error(f"Данные из БД для компании '{company_id}' получены не полностью, отправка отменена")
+            return UploadJob(result.finish(CompanyResult.FAILED, 'ошибка БД'))
+        self.logger.info(f"Количество записей '{db.row_count}' получено из БД.")
+        if not self.config.is_debug_limit_off: # игнорируем минимальный лимит по компании 
+            if db.row_count < min_counter:
+                self.logger.error(f"Количество сотрудников для компании '{company_id}' в агентстве '{agency_name}' меньше {min_counter}")
+                return UploadJob(result.finish(CompanyResult.SKIPPED, f'записей меньше {min_counter}'))
+        else:
+            self.logger.info(f"Включен флаг отладки - ограничение '{min_counter}' игнорируется.")
 
+        if delta is not None:
+            if not delta:
+                self.logger.info(f"Изменений по сотрудникам '{company_id}' нет, отправка не требуется")
+                return UploadJob(result.finish(CompanyResult.NO_CHANGES))
             self.logger.info(f"Формирование xml для '{company_id}' в агентстве '{agency_name}'")
-            finish_xml = self._createXML_aero(employee_db_list, company_id)
-            self.logger.info(f"Отправка данных сотрудников '{company_id}' в агентство '{agency_name}'")
-            
-            user_agent, url, sourceUrl = agency.userAgent, agency.url, agency.sourceUrl
-            headers = {
-                "Host": sourceUrl,
-                "User-Agent": user_agent,
-                "Content-Type": "application/vnd.aeroclub.integration-hub.profiles.v1+xml; charset=UTF-8"
-            }
-            username, password = agency.username, agency.decrypted_password
-            response_content = proxy.send_data(url, headers, username, password, finish_xml)
-            #if response_content: # обработка респонза от Aero
-            #    pass # <-- тут можно обработать обратный ответ, если таковой приходит в ответ.
-            
+            # пачки формируются по мере отправки
+            batches = stage_timings.iterate('build', self._createXML_aero_batches(delta.rows, company_id, delta.terminated_keys, next_size,
+                                                                                    columns, skip_empty=True))
+
+        user_agent, url, sourceUrl = agency.userAgent, agency.url, agency.sourceUrl
+        headers = {
+            "Host": sourceUrl,
+            "User-Agent": user_agent,
+            "Content-Type": "application/vnd.aeroclub.integration-hub.profiles.v1+xml; charset=UTF-8"
+        }
+        username, password = agency.username, agency.decrypted_password
+        return UploadJob(result, agency_name, batches, url, headers, username, password,
+                         getattr(agency, 'compression', None), delta)
@@ -1,5 +1,7 @@
 import logging
-from data_parser import TravelParser, AeroParser
+import multiprocessing
+import time
+from timing import stage_timings, StageTimings, RunProfiler
 from config import Configuration, setupLogging, prog_name, prog_version, prog_version_date
 
 def main():
@@ -12,14 +14,30 @@ def main():
         return
     
     logger.info(f'Приложение запущено. {prog_name}, версия: {prog_version}, {prog_version_date}.')
-    if config.agency == Configuration.AGENCY_CBTC:
-        TravelParser(config).travel_agent()
-    elif config.agency == Configuration.AGENCY_AERO:
-        AeroParser(config).aero_agent()
-    else:
+    if config.is_benchmark: # замер производительности на синтетических строках, без БД и отправки
+        from benchmark import Benchmark
+        Benchmark(config).run()
+        logger.info("Замер производительности завершен.")
+        return
+    if config.agency not in (Configuration.AGENCY_CBTC, Configuration.AGENCY_AERO):
         logger.error(f"Агентство '{config.agency}' не существует." if config.agency else "Агентство не указано.")
         return
+    # модули выгрузки импортируются только для запуска агентства: режимы паролей и замера их не загружают
+    from data_parser import TravelParser, AeroParser
+    from metrics import RunMetrics
+    from connect_db import ConnectionPool
+    started_at, started = time.time(), time.perf_counter()
+    with RunProfiler(config), ConnectionPool(config) as db_pool: # соединения с БД общие на весь запуск и закрываются по его окончании
+        if config.agency == Configuration.AGENCY_CBTC:
+            results = TravelParser(config, db_pool).travel_agent()
+        elif config.agency == Configuration.AGENCY_AERO:
+            results = AeroParser(config, db_pool).aero_agent()
+    duration = time.perf_counter() - started
+    stages = stage_timings.format(StageTimings.RUN)
+    logger.info(f"Длительность запуска {duration * 1000:.0f} мс" + (f", этапы вне компаний: {stages}" if stages else ''))
+    RunMetrics(config).export(config.agency, results, stage_timings.summary(), started_at, duration)
     logger.info("Приложение заверешено корректно.")
         
 if __name__ == "__main__":
+    multiprocessing.freeze_support() # процессы формирования профилей в собранном exe
     main()
\ No newline at end of file
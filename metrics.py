@@ -0,0 +1,207 @@
+import logging
+import sqlite3
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+
+from config import Configuration
+from data_parser import CompanyResult
+
+class RunMetrics:
+    """Метрики запуска для мониторинга: файл в текстовом формате Prometheus (для textfile collector node_exporter),
+    такой же json и строка в локальной истории запусков (SQLite) для графиков и поиска регрессий.\n
+    Файлы перезаписываются атомарно (запись во временный файл и замена), поэтому сборщик не видит их частично записанными.
+    """
+    DEFAULT_PATH = './metrics/AeroTravel' # без агентства и расширения: <путь>_<агентство>.prom и .json
+    DEFAULT_HISTORY_PATH = './metrics/AeroTravelHistory.db'
+    PREFIX = 'aerotravel'
+
+    def __init__(self, config: Configuration) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.config = config
+        settings = config.settings.settings
+        self.path = getattr(settings, 'metricsPath', self.DEFAULT_PATH)
+        self.history_path = getattr(settings, 'metricsHistoryPath', self.DEFAULT_HISTORY_PATH)
+
+    @staticmethod
+    def _company_row(result, stages: dict) -> dict:
+        upload = stages.get('upload', dict())
+        return {
+            'company': result.company_key,
+            'company_id': result.company_id,
+            'status': result.status,
+            'message': result.message,
+            'rows': result.rows,
+            'profiles_sent': result.profiles - result.failed_profiles,
+            'profiles_failed': result.failed_profiles,
+            'batches': result.batches,
+            'batches_failed': result.failed_batches,
+            'agency_errors': result.agency_errors,
+            'bytes_out': upload.get('bytes_out', 0),
+            'bytes_in': upload.get('bytes_in', 0),
+            'retries': upload.get('retries', 0),
+            'proxy': result.proxy,
+            'http_status': result.http_status,
+            'stages': stages,
+        }
+
+    def collect(self, agency: str, results: list, timings: dict, started_at: float, duration: float) -> dict:
+        """Метрики запуска по результатам компаний и длительностям этапов.
+
+        Args:
+            agency (str): код агентства (AERO, CBTC)
+            results (list): результаты обработки компаний (CompanyResult)
+            timings (dict): stage_timings.summary()
+            started_at (float): время начала запуска (time.time())
+            duration (float): длительность запуска в секундах
+
+        Returns:
+            dict: метрики запуска
+        """
+        companies = [self._company_row(result, timings.get(result.company_key, dict())) for result in results]
+        failed = [company for company in companies if company['status'] == CompanyResult.FAILED]
+        return {
+            'agency': agency,
+            'started_at': datetime.fromtimestamp(started_at).isoformat(timespec='seconds'),
+            'timestamp': round(started_at, 3),
+            'duration_seconds': round(duration, 3),
+            'success': bool(results) and not failed,
+            'companies_total': len(companies),
+            'companies_failed': len(failed),
+            'rows': sum(company['rows'] for company in companies),
+            'profiles_sent': sum(company['profiles_sent'] for company in companies),
+            'profiles_failed': sum(company['profiles_failed'] for company in companies),
+            'bytes_out': sum(company['bytes_out'] for company in companies),
+            'run_stages': timings.get('', dict()),
+            'companies': companies,
+        }
+
+    @staticmethod
+    def _label(value) -> str:
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    def _prometheus(self, metrics: dict) -> str:
+        """Текстовый формат Prometheus."""
+        agency = metrics['agency']
+        families = dict() # имя -> (тип, описание, строки)
+
+        def add(name, kind, help_text, value, **labels):
+            family = families.setdefault(f'{self.PREFIX}_{name}', (kind, help_text, list()))
+            label_text = ','.join(f'{key}="{self._label(label)}"' for key, label in {'agency': agency, **labels}.items())
+            family[2].append(f'{self.PREFIX}_{name}{{{label_text}}} {value}')
+
+        add('run_timestamp_seconds', 'gauge', 'Время начала запуска (unix)', metrics['timestamp'])
+        add('run_duration_seconds', 'gauge', 'Длительность запуска', metrics['duration_seconds'])
+        add('run_success', 'gauge', 'Запуск без компаний с ошибками', int(metrics['success']))
+        add('run_companies', 'gauge', 'Компаний в запуске', metrics['companies_total'])
+        add('run_companies_failed', 'gauge', 'Компаний с ошибками', metrics['companies_failed'])
+        for company in metrics['companies']:
+            labels = {'company': company['company']}
+            add('company_status', 'gauge', 'Статус компании (1 - текущий)', 1, **labels, status=company['status'])
+            add('company_rows', 'gauge', 'Строк из БД', company['rows'], **labels)
+            add('company_profiles_sent', 'gauge', 'Профилей в принятых пачках', company['profiles_sent'], **labels)
+            add('company_profiles_failed', 'gauge', 'Профилей в непринятых пачках', company['profiles_failed'], **labels)
+            add('company_batches', 'gauge', 'Отправленных пачек', company['batches'], **labels)
+            add('company_batches_failed', 'gauge', 'Непринятых пачек', company['batches_failed'], **labels)
+            add('company_agency_errors', 'gauge', 'Сотрудников с ошибками в ответе агентства', company['agency_errors'], **labels)
+            add('company_payload_bytes', 'gauge', 'Байт отправлено в агентство', company['bytes_out'], **labels)
+            add('company_response_bytes', 'gauge', 'Байт получено от агентства', company['bytes_in'], **labels)
+            add('company_upload_retries', 'gauge', 'Повторов отправки', company['retries'], **labels)
+            if company['http_status'] is not None:
+                add('company_http_status', 'gauge', 'Код http последней отправки', company['http_status'], **labels)
+            if company['proxy']:
+                add('company_proxy_info', 'gauge', 'Прокси последней отправки', 1, **labels, proxy=company['proxy'])
+        stage_sets = [('', metrics['run_stages'])] + [(company['company'], company['stages']) for company in metrics['companies']]
+        for company_key, stages in stage_sets:
+            for stage, stats in stages.items():
+                add('stage_duration_seconds', 'gauge', 'Собственное время этапа', round(stats['ms'] / 1000, 6), company=company_key, stage=stage)
+                add('stage_rows', 'gauge', 'Строк, обработанных этапом', stats['rows'], company=company_key, stage=stage)
+
+        lines = list()
+        for name, (kind, help_text, samples) in families.items():
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}', *samples]
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _write_atomic(path: Path, text: str) -> None:
+        temp_path = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+        with open(temp_path, mode='w', encoding='utf-8', newline='\n') as temp_file:
+            temp_file.write(text)
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        os.replace(temp_path, path)
+
+    def _append_history(self, metrics: dict) -> None:
+        Path(self.history_path).parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.history_path)
+        try:
+            with conn:
+                conn.execute('''CREATE TABLE IF NOT EXISTS runs (
+                                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                    started_at TEXT NOT NULL,
+                                    agency TEXT NOT NULL,
+                                    duration_seconds REAL,
+                                    success INTEGER,
+                                    companies INTEGER,
+                                    companies_failed INTEGER,
+                                    rows INTEGER,
+                                    profiles_sent INTEGER,
+                                    profiles_failed INTEGER,
+                                    bytes_out INTEGER,
+                                    run_stages TEXT)''')
+                conn.execute('''CREATE TABLE IF NOT EXISTS company_runs (
+                                    run_id INTEGER NOT NULL REFERENCES runs(id),
+                                    company TEXT NOT NULL,
+                                    status TEXT,
+                                    rows INTEGER,
+                                    profiles_sent INTEGER,
+                                    profiles_failed INTEGER,
+                                    batches INTEGER,
+                                    batches_failed INTEGER,
+                                    agency_errors INTEGER,
+                                    bytes_out INTEGER,
+                                    retries INTEGER,
+                                    proxy TEXT,
+                                    http_status INTEGER,
+                                    stages TEXT,
+                                    PRIMARY KEY (run_id, company))''')
+                run_id = conn.execute('''INSERT INTO runs (started_at, agency, duration_seconds, success, companies, companies_failed,
+                                                           rows, profiles_sent, profiles_failed, bytes_out, run_stages)
+                                         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                                      (metrics['started_at'], metrics['agency'], metrics['duration_seconds'], int(metrics['success']),
+                                       metrics['companies_total'], metrics['companies_failed'], metrics['rows'], metrics['profiles_sent'],
+                                       metrics['profiles_failed'], metrics['bytes_out'], json.dumps(metrics['run_stages']))).lastrowid
+                conn.executemany('''INSERT INTO company_runs (run_id, company, status, rows, profiles_sent, profiles_failed, batches,
+                                                              batches_failed, agency_errors, bytes_out, retries, proxy, http_status, stages)
+                                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                                 [(run_id, company['company'], company['status'], company['rows'], company['profiles_sent'],
+                                   company['profiles_failed'], company['batches'], company['batches_failed'], company['agency_errors'],
+                                   company['bytes_out'], company['retries'], company['proxy'], company['http_status'],
+                                   json.dumps(company['stages'])) for company in metrics['companies']])
+        finally:
+            conn.close()
+
+    def export(self, agency: str, results: list, timings: dict, started_at: float, duration: float) -> None:
+        """Запись метрик запуска: .prom, .json и история. Ошибки записи только логируются, на результат запуска не влияют.
+
+        Args:
+            agency (str): код агентства (AERO, CBTC)
+            results (list): результаты обработки компаний (CompanyResult)
+            timings (dict): stage_timings.summary()
+            started_at (float): время начала запуска (time.time())
+            duration (float): длительность запуска в секундах
+        """
+        metrics = self.collect(agency, results, timings, started_at, duration)
+        try:
+            path = Path(f'{self.path}_{agency}') # агентства запускаются отдельно, у каждого свои файлы
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._write_atomic(path.with_name(path.name + '.prom'), self._prometheus(metrics))
+            self._write_atomic(path.with_name(path.name + '.json'), json.dumps(metrics, ensure_ascii=False, indent=2))
+            self.logger.debug(f"Метрики запуска записаны: '{path}.prom', '{path}.json'")
+        except Exception as ex:
+            self.logger.error(f'Ошибка записи метрик запуска: {str(ex)}')
+        try:
+            self._append_history(metrics)
+        except Exception as ex:
+            self.logger.error(f'Ошибка записи истории запусков: {str(ex)}')
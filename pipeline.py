@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from config import current_company
+
+class UploadPipeline:
+    """asyncio-конвейер обработки компаний агентства: подготовка (БД, сравнение со снимком) -> формирование и сериализация пачек -> отправка.\n
+    Стадии связаны ограниченными очередями и работают одновременно: пока отправляется пачка одной компании, формируется следующая
+    и читаются данные следующей компании. Блокирующие вызовы БД, формирования и http выполняются в пулах потоков.
+    """
+    DEFAULT_QUEUE_SIZE = 4 # пачек/компаний, ожидающих следующую стадию
+    _DONE = object()       # признак окончания данных в очереди
+
+    def __init__(self, workers: int, queue_size: int = DEFAULT_QUEUE_SIZE) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.workers = max(1, workers)
+        self.queue_size = max(1, queue_size)
+
+    @staticmethod
+    def _in_company(company_key, func, *args):
+        """Вызов в потоке пула с пометкой сообщений лога ключом компании."""
+        token = current_company.set(company_key)
+        try:
+            return func(*args)
+        finally:
+            current_company.reset(token)
+
+    def run(self, company_keys: list, prepare, send) -> list:
+        """Обработка компаний конвейером.
+
+        Args:
+            company_keys (list): ключи компаний из settings.yaml
+            prepare (Callable): подготовка компании по ключу, возвращает UploadJob (не выбрасывает исключений)
+            send (Callable): отправка пачки (job, payload, tab_nums), возвращает True при успехе
+
+        Returns:
+            list: результаты по компаниям (CompanyResult) в порядке company_keys
+        """
+        self.logger.info(f"Конвейерная обработка компаний, потоков '{self.workers}', очередь '{self.queue_size}'")
+        jobs = asyncio.run(self._run(company_keys, prepare, send))
+        results = list()
+        for company_key in company_keys:
+            result = jobs[company_key].result
+            results.append(result if result.status else result.finish_batches())
+        return results
+
+    async def _run(self, company_keys: list, prepare, send) -> dict:
+        loop = asyncio.get_running_loop()
+        jobs = dict()
+        prepared = asyncio.Queue(self.queue_size)
+        built = asyncio.Queue(self.queue_size)
+        keys = iter(company_keys)
+        workers = min(self.workers, len(company_keys)) or 1
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prepare') as prepare_executor, \
+             ThreadPoolExecutor(max_workers=1, thread_name_prefix='build') as build_executor, \
+             ThreadPoolExecutor(max_workers=workers, thread_name_prefix='send') as send_executor:
+
+            def call(executor, company_key, func, *args):
+                return loop.run_in_executor(executor, functools.partial(self._in_company, company_key, func, *args))
+
+            async def prepare_worker():
+                for company_key in keys:
+                    job = await call(prepare_executor, company_key, prepare, company_key)
+                    jobs[company_key] = job
+                    if job.result.status is None: # компания без изменений, пропущена или с ошибкой дальше не идет
+                        await prepared.put((company_key, job))
+
+            async def prepare_stage():
+                await asyncio.gather(*(prepare_worker() for _ in range(workers)))
+                await prepared.put(self._DONE)
+
+            async def build_stage():
+                while (item := await prepared.get()) is not self._DONE:
+                    company_key, job = item
+                    batches = iter(job.batches)
+                    while True:
+                        try:
+                            batch = await call(build_executor, company_key, next, batches, None)
+                        except Exception as ex:
+                            self.logger.exception(f"Ошибка формирования пачки для '{company_key}': {str(ex)}")
+                            job.result.add_batch(0, False)
+                            break
+                        if batch is None:
+                            break
+                        await built.put((company_key, job, batch))
+                for _ in range(workers):
+                    await built.put(self._DONE)
+
+            async def send_worker():
+                while (item := await built.get()) is not self._DONE:
+                    company_key, job, (payload, tab_nums) = item
+                    try:
+                        sent = await call(send_executor, company_key, send, job, payload, tab_nums)
+                    except Exception as ex:
+                        self.logger.exception(f"Ошибка отправки пачки для '{company_key}': {str(ex)}")
+                        sent = False
+                    job.result.add_batch(len(tab_nums), sent) # счетчики меняются только в потоке цикла событий
+
+            await asyncio.gather(prepare_stage(), build_stage(), *(send_worker() for _ in range(workers)))
+        return jobs
@@ -1,34 +1,343 @@
-import requests
 import logging
 import re
-from requests.auth import HTTPBasicAuth
+import os, json, time
+import gzip, zlib
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from pathlib import Path
 
 from config import Configuration
+from timing import stage_timings
+
+class ProxyHealth:
+    """Сохраняемая между запусками таблица здоровья прокси: успехи, ошибки, сглаженная задержка и размыкатель цепи.
+    """
+    DEFAULT_PATH = './cache/ProxyHealth.json'
+    DEFAULT_FAILURE_THRESHOLD = 3  # подряд ошибок до размыкания
+    DEFAULT_COOLDOWN = 600         # секунд, на которые прокси исключается из попыток
+    LATENCY_WEIGHT = 0.3           # вес нового замера в сглаженной задержке
+
+    def __init__(self, settings) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.path = getattr(settings, 'proxyHealthPath', self.DEFAULT_PATH)
+        self.failure_threshold = getattr(settings, 'proxyFailureThreshold', self.DEFAULT_FAILURE_THRESHOLD)
+        self.cooldown = getattr(settings, 'proxyCooldown', self.DEFAULT_COOLDOWN)
+        self.lock = threading.Lock()
+        self.table = self._load()
+
+    def _load(self) -> dict:
+        try:
+            with open(self.path, encoding='utf-8') as health_file:
+                return json.load(health_file)
+        except FileNotFoundError:
+            return dict()
+        except Exception as ex:
+            self.logger.warning(f'Таблица здоровья прокси повреждена и будет перезаписана: {str(ex)}')
+            return dict()
+
+    def save(self) -> None:
+        """Атомарная запись таблицы на диск."""
+        try:
+            path = Path(self.path)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(path.name + '.tmp')
+            with self.lock, open(tmp_path, mode='w', encoding='utf-8') as health_file:
+                json.dump(self.table, health_file, indent=2)
+            os.replace(tmp_path, path)
+        except Exception as ex:
+            self.logger.warning(f'Не удалось сохранить таблицу здоровья прокси: {str(ex)}')
+
+    def _entry(self, proxy: str) -> dict:
+        return self.table.setdefault(proxy, {'successes': 0, 'failures': 0, 'consecutive_failures': 0, 'latency': None, 'open_until': 0})
+
+    def order(self, proxies: list) -> list:
+        """Порядок попыток: сначала исправные прокси по возрастанию задержки, затем еще не измеренные (в порядке PAC),
+        в конце прокси с разомкнутой цепью - как последний шанс.
+
+        Args:
+            proxies (list): список прокси в порядке PAC-файла
+
+        Returns:
+            list: упорядоченный список прокси
+        """
+        now = time.time()
+        with self.lock:
+            entries = {proxy: dict(self.table.get(proxy, {})) for proxy in proxies}
+        opened = [proxy for proxy in proxies if entries[proxy].get('open_until', 0) > now]
+        measured = [proxy for proxy in proxies if proxy not in opened and entries[proxy].get('latency') is not None]
+        unmeasured = [proxy for proxy in proxies if proxy not in opened and proxy not in measured]
+        measured.sort(key=lambda proxy: entries[proxy]['latency'])
+        if opened:
+            self.logger.debug(f'Прокси с разомкнутой цепью будут опробованы последними: {opened}')
+        return measured + unmeasured + opened
+
+    def record_success(self, proxy: str, latency: float) -> None:
+        with self.lock:
+            entry = self._entry(proxy)
+            entry['successes'] += 1
+            entry['consecutive_failures'], entry['open_until'] = 0, 0
+            previous = entry['latency']
+            entry['latency'] = latency if previous is None else previous + self.LATENCY_WEIGHT * (latency - previous)
+
+    def record_failure(self, proxy: str) -> None:
+        with self.lock:
+            entry = self._entry(proxy)
+            entry['failures'] += 1
+            entry['consecutive_failures'] += 1
+            if entry['consecutive_failures'] >= self.failure_threshold:
+                entry['open_until'] = time.time() + self.cooldown
+                self.logger.warning(f'Прокси {proxy} исключен из попыток на {self.cooldown} сек. после {entry["consecutive_failures"]} ошибок подряд')
+
+class UploadLimiter:
+    """Адаптивное ограничение выгрузок в агентство (AIMD): число одновременных запросов и доля размера пачки
+    растут на единицу/шаг после каждого быстрого успешного ответа и уменьшаются вдвое при перегрузке агентства -
+    коды 429 и 5xx, отсутствие ответа (таймаут, обрыв) или ответ дольше targetLatency.
+    Состояние ведется отдельно по каждому url агентства и действует до конца запуска.
+    """
+    DEFAULT_TARGET_LATENCY = 60 # секунд, более долгий ответ считается признаком перегрузки
+    DEFAULT_MIN_BATCH_SIZE = 50
+    OVERLOAD_CODES = {429, 500, 502, 503, 504}
+    BATCH_STEP = 0.1 # прирост доли размера пачки после успешного ответа
+
+    def __init__(self, settings, max_in_flight: int) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.max_in_flight = max(1, getattr(settings, 'maxInFlight', 0) or max_in_flight)
+        self.target_latency = getattr(settings, 'targetLatency', self.DEFAULT_TARGET_LATENCY)
+        self.min_batch_size = getattr(settings, 'minBatchSize', self.DEFAULT_MIN_BATCH_SIZE)
+        self.condition = threading.Condition()
+        self.state = dict() # url -> {'limit', 'in_flight', 'scale'}
+
+    def _entry(self, url: str) -> dict:
+        return self.state.setdefault(url, {'limit': float(self.max_in_flight), 'in_flight': 0, 'scale': 1.0})
+
+    def acquire(self, url: str) -> None:
+        """Ожидание свободного места среди одновременных запросов к агентству."""
+        with self.condition:
+            entry = self._entry(url)
+            while entry['in_flight'] >= int(entry['limit']):
+                self.condition.wait()
+            entry['in_flight'] += 1
+
+    def try_acquire(self, url: str) -> bool:
+        """Место для дублирующей попытки запроса без ожидания.
+
+        Returns:
+            bool: True если место занято, False - одновременных запросов уже максимум
+        """
+        with self.condition:
+            entry = self._entry(url)
+            if entry['in_flight'] >= int(entry['limit']):
+                return False
+            entry['in_flight'] += 1
+            return True
+
+    def release_slot(self, url: str) -> None:
+        """Освобождение места дублирующей попытки без пересчета ограничений (результат учитывается в release)."""
+        with self.condition:
+            self._entry(url)['in_flight'] -= 1
+            self.condition.notify_all()
+
+    def release(self, url: str, latency: float, status_code) -> None:
+        """Учет результата запроса и пересчет ограничений.
+
+        Args:
+            url (str): адрес агентства
+            latency (float): длительность запроса в секундах
+            status_code (int): код http ответа, None - ответ не получен
+        """
+        with self.condition:
+            entry = self._entry(url)
+            entry['in_flight'] -= 1
+            if status_code is None or status_code in self.OVERLOAD_CODES or latency > self.target_latency:
+                entry['limit'] = max(1.0, entry['limit'] / 2)
+                entry['scale'] = entry['scale'] / 2
+                self.logger.warning(f"Перегрузка агентства (код http {status_code}, {latency:.1f} сек.): "
+                                    f"одновременных запросов {int(entry['limit'])}, доля размера пачки {entry['scale']:.2f}")
+            elif status_code < 400:
+                entry['limit'] = min(float(self.max_in_flight), entry['limit'] + 1)
+                entry['scale'] = min(1.0, entry['scale'] + self.BATCH_STEP)
+            self.condition.notify_all()
+
+    def batch_size(self, url: str, base: int) -> int:
+        """Текущий размер пачки для агентства.
+
+        Args:
+            url (str): адрес агентства
+            base (int): размер пачки из settings.yaml, 0 - без разбиения
+
+        Returns:
+            int: размер пачки, не меньше minBatchSize
+        """
+        if not base:
+            return base
+        with self.condition:
+            scale = self._entry(url)['scale']
+        return max(min(base, self.min_batch_size), int(base * scale))
 
 class Proxy:
+    DEFAULT_POOL_SIZE = 10
+    DEFAULT_PAC_CACHE_PATH = './cache/ProxyList.json'
+    DEFAULT_PAC_CACHE_TTL = 86400 # секунд
+    DEFAULT_PAC_TIMEOUT = 10 # секунд
+    DEFAULT_CONNECT_TIMEOUT = 10 # секунд
+    DEFAULT_READ_TIMEOUT = 300 # секунд, агентство обрабатывает выгрузку до ответа
+    ENCODERS = {'gzip': gzip.compress, 'deflate': zlib.compress} # поддерживаемое сжатие тела запроса (Content-Encoding)
+    ENCODING_REJECTED = {400, 415} # коды ответа, при которых запрос повторяется без сжатия
+    PROXY_FAILURE_CODES = {407, 502, 504} # ошибки прокси и шлюза, учитываемые в таблице здоровья как отказ
+    DIRECT = 'direct' # отправка без прокси в last_request
+
     def __init__(self, config: Configuration):
         self.logger = logging.getLogger(__name__)
         self.config = config
         self.settings = config.settings
+        self.session = self._create_session()
+        self._auth = dict() # (username, password) -> HTTPBasicAuth
+        self.pac_cache_path = getattr(self.settings.settings, 'pacCachePath', self.DEFAULT_PAC_CACHE_PATH)
+        self.pac_cache_ttl = getattr(self.settings.settings, 'pacCacheTtl', self.DEFAULT_PAC_CACHE_TTL)
+        self.pac_timeout = getattr(self.settings.settings, 'pacTimeout', self.DEFAULT_PAC_TIMEOUT)
+        self.timeout = (getattr(self.settings.settings, 'connectTimeout', self.DEFAULT_CONNECT_TIMEOUT),
+                        getattr(self.settings.settings, 'readTimeout', self.DEFAULT_READ_TIMEOUT))
+        self.health = ProxyHealth(self.settings.settings)
+        # задержка в секундах, после которой тот же запрос дублируется через следующий прокси (0 - без дублирования)
+        self.hedge_delay = getattr(self.settings.settings, 'hedgeDelay', 0)
+        self._plain_urls = set() # url, отклонившие сжатый запрос - до конца запуска отправляются без сжатия
+        self._last = threading.local() # прокси и код http последней отправки в потоке (last_request)
+        # адаптивное ограничение одновременных выгрузок и размера пачек, None - выключено
+        self.limiter = UploadLimiter(self.settings.settings, self.config.workers) \
+            if getattr(self.settings.settings, 'adaptiveUpload', False) else None
         self.proxy_list = None
         if self.config.proxy == Configuration.PROXY_ZSCALER:
-            self.proxy_list = self._get_proxy_list()
+            with stage_timings.measure('pac'):
+                self.proxy_list = self._get_proxy_list()
         elif self.config.proxy == Configuration.PROXY_SYSTEM:
             self.proxy_list = [self.settings.settings.proxyIp]
 
+    def _create_session(self) -> 'requests.Session':
+        """Долгоживущая сессия на весь запуск: keep-alive соединения (в т.ч. туннели через прокси) переиспользуются
+        между отправками, размер пула - settings.httpPoolSize, но не меньше количества потоков обработки компаний.
+
+        Returns:
+            requests.Session: сессия
+        """
+        import requests # импорт при создании Proxy (запуск агентства), а не при старте приложения
+        from requests.adapters import HTTPAdapter
+        pool_size = max(getattr(self.settings.settings, 'httpPoolSize', self.DEFAULT_POOL_SIZE), self.config.workers)
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.verify = False
+        return session
+
+    def _get_auth(self, username: str, password: str) -> 'HTTPBasicAuth':
+        key = (username, password)
+        if key not in self._auth:
+            from requests.auth import HTTPBasicAuth
+            self._auth[key] = HTTPBasicAuth(username, password)
+        return self._auth[key]
+
+    def close(self) -> None:
+        """Закрытие сессии и всех ее соединений, сохранение таблицы здоровья прокси."""
+        self.session.close()
+        if self.proxy_list:
+            self.health.save()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _load_pac_cache(self) -> dict:
+        """Чтение кэша списка прокси с диска.
+
+        Returns:
+            dict: кэш (proxies, etag, last_modified, fetched_at) или пустой dict
+        """
+        try:
+            with open(self.pac_cache_path, encoding='utf-8') as cache_file:
+                return json.load(cache_file)
+        except FileNotFoundError:
+            return dict()
+        except Exception as ex:
+            self.logger.warning(f'Кэш списка прокси поврежден и будет перезаписан: {str(ex)}')
+            return dict()
+
+    def _save_pac_cache(self, cache: dict) -> None:
+        """Атомарная запись кэша списка прокси на диск."""
+        try:
+            path = Path(self.pac_cache_path)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(path.name + '.tmp')
+            with open(tmp_path, mode='w', encoding='utf-8') as cache_file:
+                json.dump(cache, cache_file)
+            os.replace(tmp_path, path)
+        except Exception as ex:
+            self.logger.warning(f'Не удалось сохранить кэш списка прокси: {str(ex)}')
+
     def _get_proxy_list(self) -> list:
-        """Функция для получения списка внешних прокси Nestle
+        """Функция для получения списка внешних прокси Nestle.\n
+        Список кэшируется на диске (settings.pacCachePath) на settings.pacCacheTtl секунд, после чего
+        перепроверяется условным запросом (ETag/If-Modified-Since). Если PAC-файл недоступен, используется устаревший кэш.
 
         Returns:
             list: список внешних прокси 
         """
-        searchIn = "//******   Use the Standard Zscaler proxies if not internal or exception   ******" # искомая строка в файле от zscaler
+        cache = self._load_pac_cache()
+        cached_proxies = cache.get('proxies')
+        if cached_proxies and time.time() - cache.get('fetched_at', 0) < self.pac_cache_ttl:
+            self.logger.debug(f'Список прокси взят из кэша: {cached_proxies}')
+            return cached_proxies
+
         NestleProxy = self.settings.settings.nestleProxy
-        prlist = requests.get(NestleProxy)
-        buffer_proxy = prlist.text
+        headers = dict()
+        if cached_proxies and cache.get('etag'):
+            headers['If-None-Match'] = cache['etag']
+        if cached_proxies and cache.get('last_modified'):
+            headers['If-Modified-Since'] = cache['last_modified']
+        try:
+            prlist = self.session.get(NestleProxy, headers=headers, timeout=self.pac_timeout)
+            prlist.raise_for_status()
+        except Exception as ex:
+            if cached_proxies:
+                self.logger.warning(f'PAC-файл недоступен, используется устаревший кэш списка прокси. Error: {str(ex)}')
+                return cached_proxies
+            self.logger.error(f'PAC-файл недоступен, кэш списка прокси отсутствует. Error: {str(ex)}')
+            return list()
+
+        if prlist.status_code == 304: # не изменился с прошлой загрузки
+            self.logger.debug('PAC-файл не изменился, используется кэш списка прокси')
+            cache['fetched_at'] = time.time()
+            self._save_pac_cache(cache)
+            return cached_proxies
+
+        proxies = self._parse_proxy_list(prlist.text)
+        if proxies:
+            self._save_pac_cache({
+                'proxies': proxies,
+                'etag': prlist.headers.get('ETag'),
+                'last_modified': prlist.headers.get('Last-Modified'),
+                'fetched_at': time.time()
+            })
+        elif cached_proxies:
+            self.logger.warning('Используется устаревший кэш списка прокси.')
+            return cached_proxies
+        return proxies
+
+    def _parse_proxy_list(self, pac_text: str) -> list:
+        """Поиск списка прокси в тексте PAC-файла.
+
+        Args:
+            pac_text (str): текст PAC-файла
+
+        Returns:
+            list: список внешних прокси
+        """
+        searchIn = "//******   Use the Standard Zscaler proxies if not internal or exception   ******" # искомая строка в файле от zscaler
         flagWrite = False
         self.logger.debug('Запрос от zscaler выполнен, ищем требуемые прокси в response')
-        buffer_proxy = buffer_proxy.splitlines()
+        buffer_proxy = pac_text.splitlines()
         #ищем нужную строку с 4 прокси адресами и пишем их в основной массив прокси
         for line in buffer_proxy:
             if(str.find(line, searchIn) != -1): # нашли искомую строку, пропускаем ее и переходим к следующей
@@ -44,38 +353,214 @@ class Proxy:
         self.logger.error('Ни одной прокси не найдено в ответе от zscaler! Возможно изменился формат ответа.')
         return list()
 
+    def _record_health(self, proxy: str, status_code: int, latency: float) -> None:
+        """Учет ответа в таблице здоровья прокси: задержка учитывается только для успешных ответов,
+        407, 502 и 504 (ошибки прокси и шлюза) считаются отказом прокси. Остальные коды, в т.ч. 500 и 503 от самого агентства,
+        на здоровье прокси не влияют.
+        """
+        if 200 <= status_code < 400:
+            self.health.record_success(proxy, latency)
+        elif status_code in self.PROXY_FAILURE_CODES:
+            self.health.record_failure(proxy)
+
     def _post_request(self, source_url: str, username: str, password: str, headers: dict, proxy: str, data: str):
         try:
             self.logger.debug(f'Запрос через {proxy=}.')
+            stage_timings.attempt()
             proxiesDict = {'http': proxy, 'https': proxy} if proxy else None 
-            response = requests.post(url=source_url, data=data, verify=False, proxies=proxiesDict, headers=headers, auth=HTTPBasicAuth(username, password))
+            started = time.perf_counter()
+            response = self.session.post(url=source_url, data=data, proxies=proxiesDict, headers=headers,
+                                         auth=self._get_auth(username, password), timeout=self.timeout)
+            if proxy:
+                self._record_health(proxy, response.status_code, time.perf_counter() - started)
             self.logger.info(f'post-запрос завершен успешно, код http возврата={response.status_code}')
             return response
         except Exception as ex:
+            if proxy:
+                self.health.record_failure(proxy)
             self.logger.error(f'Ошибка при вызове через {proxy=}. Error: {str(ex)}')
             return None
         
-    def send_data(self, url, headers, username, password, data):
-        self.logger.debug(f"Запрос на '{url=}'")
+    def _hedged_post(self, post, url: str):
+        """Отправка с дублированием: если за hedge_delay ответа нет, тот же запрос запускается через следующий прокси,
+        используется первый успешный ответ. Выгрузки в агентства идемпотентны, поэтому дубль безопасен.
+
+        При адаптивной выгрузке каждая одновременная попытка занимает место в UploadLimiter: первая - место send_data,
+        дубли - дополнительные места, дубль без свободного места не запускается. Опоздавшие попытки освобождают
+        свое место только по завершении, их ответы закрываются.
+
+        Args:
+            post (Callable): отправка запроса через указанный прокси, возвращает Response или None
+            url (str): адрес агентства для учета мест UploadLimiter
+
+        Returns:
+            Response: первый успешный ответ, иначе последний полученный ответ или None
+        """
+        proxies = iter(self.health.order(self.proxy_list))
+        last_response = None
+        pending = dict() # future -> proxy
+        slots = 1 # мест UploadLimiter у попыток запроса, первое занято в send_data
+        executor = ThreadPoolExecutor(max_workers=len(self.proxy_list), thread_name_prefix='hedge')
+
+        def launch() -> bool:
+            nonlocal slots
+            if self.limiter and len(pending) >= slots:
+                if not self.limiter.try_acquire(url):
+                    self.logger.debug('Нет свободного места для одновременного запроса, дублирование не выполняется')
+                    return False
+                slots += 1
+            proxy = next(proxies, None)
+            if proxy is None:
+                return False
+            context = contextvars.copy_context() # пометка компании в логе сохраняется в потоке запроса
+            future = executor.submit(context.run, post, proxy)
+            pending[future] = proxy
+            return True
+
+        def finish_late(future, release: bool) -> None:
+            """Завершение опоздавшей попытки: ответ закрывается, место UploadLimiter освобождается."""
+            if release:
+                self.limiter.release_slot(url)
+            if not future.cancelled() and future.exception() is None and future.result() is not None:
+                future.result().close()
+
+        try:
+            launch()
+            while pending:
+                done, _ = wait(pending, timeout=self.hedge_delay, return_when=FIRST_COMPLETED)
+                if not done:
+                    if launch():
+                        self.logger.info(f'Нет ответа за {self.hedge_delay} сек., запрос дублируется через следующий прокси')
+                    continue
+                for future in done:
+                    proxy = pending.pop(future)
+                    response = future.result()
+                    self._last.proxy = proxy
+                    if response:
+                        self.logger.info(f'Успешный http-запрос через {proxy=}')
+                        return response
+                    last_response = response if response is not None else last_response
+                launch() # завершившиеся попытки неуспешны - сразу пробуем следующий прокси
+            return last_response
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True) # опоздавшие попытки завершатся в фоне
+            late, releasing = list(pending), list(pending) if self.limiter else []
+            if self.limiter:
+                # одно место возвращается в send_data, свободные места дублей - сразу, места опоздавших - по их завершении
+                free = slots - len(late)
+                for _ in range(free - 1):
+                    self.limiter.release_slot(url)
+                if free < 1: # все места заняты опоздавшими (только при ошибке), одно из них освободит send_data
+                    releasing = late[1:]
+            for future in late:
+                future.add_done_callback(lambda future, release=future in releasing: finish_late(future, release))
+
+    def _send(self, post, url: str):
+        """Отправка запроса напрямую или через список прокси.
+
+        Args:
+            post (Callable): отправка запроса через указанный прокси (None - без прокси), возвращает Response или None
+            url (str): адрес агентства
+
+        Returns:
+            Response: успешный ответ, иначе последний полученный ответ или None
+        """
+        response = None
         if self.proxy_list is None: # proxy_list - пустой, вызов не через прокси
-            response = self._post_request(url, username, password, headers, None, data)
+            self._last.proxy = self.DIRECT
+            response = post(None)
             if response:
                 self.logger.info(f'Успешный http-запрос без прокси.')
             else: 
                 self.logger.warning('Запрос не был успешно вызван.')
+        elif self.hedge_delay and len(self.proxy_list) > 1:
+            response = self._hedged_post(post, url)
         else:
-            for proxy in self.proxy_list:
-                response = self._post_request(url, username, password, headers, proxy, data)
+            for proxy in self.health.order(self.proxy_list):
+                self._last.proxy = proxy
+                response = post(proxy)
                 if response:
                     self.logger.info(f'Успешный http-запрос через {proxy=}')
                     break
+        return response
+
+    def last_request(self) -> tuple:
+        """Прокси (DIRECT - без прокси) и код http последней отправки send_data в текущем потоке.
+
+        Returns:
+            tuple: прокси и код http, None - если запрос не выполнялся или ответа нет
+        """
+        return getattr(self._last, 'proxy', None), getattr(self._last, 'status_code', None)
+
+    def batch_size(self, url: str, base: int) -> int:
+        """Размер пачки для агентства с учетом адаптивного ограничения (base, если оно выключено)."""
+        return self.limiter.batch_size(url, base) if self.limiter else base
+
+    def send_data(self, url, headers, username, password, data, compression=None):
+        """Отправка данных в агентство.
+
+        Args:
+            url (str): адрес агентства
+            headers (dict): заголовки запроса
+            username (str): пользователь
+            password (str): пароль
+            data (bytes): тело запроса
+            compression (str): сжатие тела запроса (gzip, deflate), если агентство его отклонит - повтор без сжатия
+
+        Returns:
+            bytes: контент ответа (b'' - успешный ответ без тела) или None при неуспешном запросе
+        """
+        self.logger.debug(f"Запрос на '{url=}'")
+        self._last.proxy, self._last.status_code = None, None
+        if self.limiter:
+            self.limiter.acquire(url)
+            started, response = time.perf_counter(), None
+            try:
+                response = self._send_encoded(url, headers, username, password, data, compression)
+            finally:
+                self.limiter.release(url, time.perf_counter() - started, getattr(response, 'status_code', None))
+        else:
+            response = self._send_encoded(url, headers, username, password, data, compression)
+        self._last.status_code = getattr(response, 'status_code', None)
         # обработка респонза и возврат контента.
         response_content = None
         if response:
             if not response.content:
                 self.logger.warning(f'Обратный ответ получен, но контент ответа пустой.')
-            else:
-                response_content = response.content
+            response_content = response.content # пустой контент (b'') - успешный запрос без тела ответа
         else:
             self.logger.warning('Неуспешный http-запрос, response отсутствует.')
         return response_content
+
+    def _send_encoded(self, url, headers, username, password, data, compression):
+        """Отправка со сжатием тела запроса. Если агентство отклонит сжатый запрос, он сразу повторяется без сжатия
+        через тот же прокси; сжатие отключается до конца запуска, только если несжатый повтор успешен.
+        """
+        with stage_timings.measure('upload') as span:
+            encode = self.ENCODERS.get(compression) if url not in self._plain_urls else None
+            body = encode(data) if encode else None
+            plain_sent = list() # несжатый повтор уже учтен в байтах запроса
+            span.bytes_out += len(body) if encode else len(data)
+            if encode:
+                self.logger.debug(f'Тело запроса сжато {compression}: {len(data)} -> {len(body)} байт')
+
+            def post(proxy):
+                if not encode:
+                    return self._post_request(url, username, password, headers, proxy, data)
+                response = self._post_request(url, username, password, {**headers, 'Content-Encoding': compression}, proxy, body)
+                if response is None or response.status_code not in self.ENCODING_REJECTED:
+                    return response
+                self.logger.warning(f'Сжатый {compression} запрос отклонен (код http {response.status_code}), повтор без сжатия через {proxy=}')
+                if not plain_sent:
+                    plain_sent.append(True)
+                    span.bytes_out += len(data)
+                response = self._post_request(url, username, password, headers, proxy, data)
+                if response and url not in self._plain_urls:
+                    self.logger.warning(f'Агентство не принимает сжатие {compression}, до конца запуска запросы отправляются без сжатия')
+                    self._plain_urls.add(url)
+                return response
+
+            response = self._send(post, url)
+            if response is not None:
+                span.bytes_in = len(response.content or b'')
+        return response
@@ -0,0 +1,89 @@
+class LayoutError(Exception):
+    """Колонки результата хранимой процедуры не соответствуют ожидаемой раскладке."""
+
+class Columns:
+    """Индексы полей в строке результата, вычисленные один раз на результат хранимой процедуры.
+    Обращение к полю строки: row[columns.tab_num].
+    """
+    def __init__(self, layout_name: str, indices: dict) -> None:
+        self.layout_name = layout_name
+        self.__dict__.update(indices)
+
+class RowLayout:
+    """Раскладка строки результата хранимой процедуры: имена полей и их позиции по умолчанию.\n
+    Поля привязываются к колонкам по cursor.description: по именам колонок из секции columns в settings.yaml
+    (имя поля: имя колонки), остальные - по позиции. Несовпадение колонок обнаруживается до обработки строк.
+    """
+    def __init__(self, name: str, fields: dict) -> None:
+        self.name = name
+        self.fields = fields # имя поля -> позиция по умолчанию
+        self.default = Columns(name, fields)
+
+    def bind(self, description=None, names=None) -> Columns:
+        """Привязка полей к колонкам результата.
+
+        Args:
+            description (tuple): cursor.description результата, None - позиции по умолчанию
+            names (dict): имя поля -> имя колонки результата
+
+        Raises:
+            LayoutError: нет колонок с указанными именами или колонок меньше, чем требует раскладка
+
+        Returns:
+            Columns: индексы полей
+        """
+        names = names or dict()
+        unknown = sorted(set(names) - set(self.fields))
+        if unknown:
+            raise LayoutError(f"Раскладка '{self.name}': неизвестные поля в columns: {', '.join(unknown)}")
+        if description is None:
+            if names:
+                raise LayoutError(f"Раскладка '{self.name}': имена колонок заданы, но описание результата отсутствует")
+            return self.default
+        column_names = [column[0] for column in description]
+        positions = {column_name.lower(): index for index, column_name in enumerate(column_names)}
+        indices = dict(self.fields)
+        missing = list()
+        for field, column_name in names.items():
+            index = positions.get(str(column_name).lower())
+            if index is None:
+                missing.append(f'{field}={column_name}')
+            indices[field] = index
+        if missing:
+            raise LayoutError(f"Раскладка '{self.name}': в результате нет колонок {', '.join(missing)}. "
+                              f"Колонки результата: {', '.join(column_names)}")
+        positional = [index for field, index in indices.items() if field not in names]
+        required = max(positional) + 1 if positional else 0
+        if len(column_names) < required:
+            raise LayoutError(f"Раскладка '{self.name}': хранимая процедура вернула {len(column_names)} колонок, "
+                              f"ожидается не меньше {required}. Колонки результата: {', '.join(column_names)}")
+        return Columns(self.name, indices)
+
+TRAVEL_LAYOUT = RowLayout('CbtcTravelClick', {
+    'company_id': 0, 'tab_num': 1,
+    'en_surname': 2, 'en_name': 3, 'ru_surname': 4, 'ru_name': 5, 'ru_middle_name': 6,
+    'birthday': 7, 'country': 8, 'gender': 9,
+    'ru_passport_number': 10, 'ru_passport_issued': 11, 'ru_place_of_birth': 12,
+    'en_passport_number': 13, 'en_passport_issued': 14, 'en_passport_expires': 15,
+    'login': 16, 'position': 17, 'unit_name': 18, 'cost_name': 19, 'authorizer_tab_num': 20,
+    'role': 22, 'travel_policy': 23,
+})
+
+AERO_LAYOUT = RowLayout('AeroClub', {
+    'ru_surname': 1, 'ru_name': 2, 'ru_middle_name': 3, 'en_surname': 4, 'en_name': 5,
+    'citizenship': 6, 'gender': 7, 'birthday': 8,
+    'ru_passport_series': 9, 'ru_passport_number': 10, 'ru_passport_issued': 11,
+    'en_passport_series': 14, 'en_passport_number': 15, 'en_passport_issued': 16, 'en_passport_expires': 17,
+    'email': 20, 'tab_num': 21, 'grade': 22, 'position': 23, 'department': 24, 'division': 25,
+    'cost_center': 26, 'manager_email': 28,
+})
+
+# старый формат выгрузки АэроКлуб (_create_profile_aero_xml)
+AERO_LEGACY_LAYOUT = RowLayout('AeroClubLegacy', {
+    'ru_surname': 1, 'ru_name': 2, 'ru_middle_name': 3, 'en_surname': 4, 'en_name': 5,
+    'gender': 6, 'birthday': 7,
+    'ru_passport_series': 8, 'ru_passport_number': 9, 'ru_passport_issued': 10, 'place_of_birth': 11, 'citizenship': 12,
+    'passport_series': 13, 'passport_number': 14, 'passport_issued': 15, 'passport_expires': 16,
+    'email': 17, 'tab_num': 18, 'grade': 19, 'position': 20, 'department': 21, 'division': 22,
+    'cost_center': 23, 'manager_email': 24,
+})
@@ -0,0 +1,111 @@
+import logging
+import sqlite3
+import threading
+import hashlib
+import json
+from pathlib import Path
+
+from config import Configuration
+from timing import stage_timings
+
+class SnapshotDelta:
+    """Результат сравнения свежей выгрузки из БД со снимком прошлой успешной отправки.
+    """
+    def __init__(self, agency: str, company: str) -> None:
+        self.agency = agency
+        self.company = company
+        self.changed = list()     # новые и измененные строки
+        self.terminated = list()  # строки сотрудников, пропавших из выгрузки (из снимка)
+        self.upserts = dict()     # tabNum -> (hash, строка в json) для сохранения в снимок
+        self.removed = list()     # tabNum на удаление из снимка
+
+    @property
+    def rows(self) -> list:
+        """Строки на построение профилей: новые, измененные и уволенные."""
+        return self.changed + self.terminated
+
+    @property
+    def terminated_keys(self) -> set:
+        """Табельные номера уволенных сотрудников."""
+        return set(self.removed)
+
+    def __len__(self) -> int:
+        return len(self.changed) + len(self.terminated)
+
+class SnapshotStore:
+    """Локальный снимок отправленных в агентства сотрудников (хэш содержимого строки по агентству, компании и tabNum).
+    Один объект используется всеми потоками обработки компаний, обращения к БД снимка сериализуются блокировкой.
+    """
+    DEFAULT_PATH = './snapshots/AeroTravelSnapshot.db'
+
+    def __init__(self, config: Configuration) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.path = getattr(config.settings.settings, 'snapshotPath', self.DEFAULT_PATH)
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS snapshot (
+                                agency TEXT NOT NULL,
+                                company TEXT NOT NULL,
+                                tab_num TEXT NOT NULL,
+                                hash TEXT NOT NULL,
+                                row TEXT NOT NULL,
+                                PRIMARY KEY (agency, company, tab_num))''')
+        self.conn.commit()
+        self.logger.debug(f"Снимок сотрудников открыт: '{self.path}'")
+
+    @staticmethod
+    def _row_to_json(row) -> str:
+        return json.dumps(list(row), ensure_ascii=False, default=str)
+
+    def diff(self, agency: str, company: str, rows, key_index: int) -> SnapshotDelta:
+        """Сравнение строк из БД со снимком.
+
+        Args:
+            agency (str): код агентства
+            company (str): ключ компании из settings.yaml
+            rows (list): строки, полученные из БД
+            key_index (int): индекс табельного номера в строке
+
+        Returns:
+            SnapshotDelta: новые, измененные и уволенные сотрудники
+        """
+        delta = SnapshotDelta(agency, company)
+        with stage_timings.measure('snapshot') as span:
+            with self.lock:
+                stored = dict(self.conn.execute('SELECT tab_num, hash FROM snapshot WHERE agency=? AND company=?', (agency, company)))
+            for row in rows:
+                span.rows += 1
+                tab_num = f'{row[key_index]:0>8}'
+                row_json = self._row_to_json(row)
+                row_hash = hashlib.sha1(row_json.encode('utf-8')).hexdigest()
+                if stored.pop(tab_num, None) != row_hash:
+                    delta.changed.append(row)
+                    delta.upserts[tab_num] = (row_hash, row_json)
+            for tab_num in stored.keys(): # в выгрузке сотрудника нет, значит уволен
+                with self.lock:
+                    row_json = self.conn.execute('SELECT row FROM snapshot WHERE agency=? AND company=? AND tab_num=?',
+                                                 (agency, company, tab_num)).fetchone()[0]
+                delta.terminated.append(tuple(json.loads(row_json)))
+                delta.removed.append(tab_num)
+        self.logger.info(f"Сравнение со снимком для '{company}': новых/измененных '{len(delta.changed)}', уволенных '{len(delta.terminated)}'")
+        return delta
+
+    def commit(self, delta: SnapshotDelta, tab_nums=None) -> None:
+        """Сохранение отправленной дельты в снимок. Вызывается только после успешной отправки.
+
+        Args:
+            delta (SnapshotDelta): отправленная дельта
+            tab_nums (Iterable): табельные номера успешно отправленной пачки, None - вся дельта
+        """
+        sent = set(tab_nums) if tab_nums is not None else None
+        with stage_timings.measure('snapshot'), self.lock, self.conn:
+            self.conn.executemany('INSERT OR REPLACE INTO snapshot (agency, company, tab_num, hash, row) VALUES (?, ?, ?, ?, ?)',
+                                  [(delta.agency, delta.company, tab_num, row_hash, row_json)
+                                   for tab_num, (row_hash, row_json) in delta.upserts.items() if sent is None or tab_num in sent])
+            self.conn.executemany('DELETE FROM snapshot WHERE agency=? AND company=? AND tab_num=?',
+                                  [(delta.agency, delta.company, tab_num) for tab_num in delta.removed if sent is None or tab_num in sent])
+        self.logger.debug(f"Снимок для '{delta.company}' обновлен")
+
+    def close(self) -> None:
+        self.conn.close()
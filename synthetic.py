@@ -0,0 +1,125 @@
+import random
+from datetime import date, timedelta
+
+from row_layout import TRAVEL_LAYOUT, AERO_LAYOUT
+from validation import TRAVEL_RULES, AERO_RULES
+
+class SyntheticRows:
+    """Детерминированный генератор строк хранимых процедур CbtcTravelClick и AeroClub для замеров производительности.
+    Строки раскладываются по позициям TRAVEL_LAYOUT/AERO_LAYOUT. При одинаковом seed генерируются одинаковые строки.
+
+    Args:
+        seed (int): начальное значение генератора случайных чисел
+        foreign_ratio (float): доля иностранцев (без российского паспорта)
+        missing_ratio (float): доля строк с незаполненным критичным полем (не проходят проверку правил)
+        holding_ratio (float): доля сотрудников с ролью холдинга
+        holding_role (str): роль холдинга (CbtcTravelClick.newUser.holdingUserRole)
+    """
+    TAB_NUM_START = 100000
+    RU_SURNAMES = (('Иванов', 'Ivanov'), ('Петров', 'Petrov'), ('Смирнов', 'Smirnov'), ('Кузнецов', 'Kuznetsov'),
+                   ('Попов', 'Popov'), ('Соколов', 'Sokolov'), ('Лебедев', 'Lebedev'), ('Козлов', 'Kozlov'))
+    RU_NAMES = (('Иван', 'Ivan'), ('Петр', 'Petr'), ('Алексей', 'Aleksei'), ('Мария', 'Mariia'),
+                ('Анна', 'Anna'), ('Елена', 'Elena'), ('Сергей', 'Sergei'), ('Ольга', 'Olga'))
+    MIDDLE_NAMES = ('Иванович', 'Петрович', 'Сергеевна', 'Алексеевна', None)
+    COUNTRIES = ('BY', 'KZ', 'UZ', 'AM', 'DE', 'CH')
+    CITIES = ('Москва', 'Пермь', 'Вологда', 'Самара', 'Тимашевск')
+    POSITIONS = ('Менеджер', 'Старший менеджер', 'Специалист', 'Руководитель направления', 'Торговый представитель')
+    UNITS = ('Продажи', 'Маркетинг', 'Финансы', 'Логистика', 'Производство')
+    TRAVEL_POLICIES = ('SELF', 'HOLDING', 'STANDARD')
+
+    def __init__(self, seed: int = 1, foreign_ratio: float = 0.3, missing_ratio: float = 0.02,
+                 holding_ratio: float = 0.05, holding_role: str = 'sbt_manager') -> None:
+        self.seed = seed
+        self.foreign_ratio = foreign_ratio
+        self.missing_ratio = missing_ratio
+        self.holding_ratio = holding_ratio
+        self.holding_role = holding_role
+
+    @staticmethod
+    def _date(rnd: random.Random, first_year: int, last_year: int) -> str:
+        start = date(first_year, 1, 1)
+        return (start + timedelta(days=rnd.randrange((date(last_year, 12, 31) - start).days))).strftime('%d.%m.%Y')
+
+    @staticmethod
+    def _row(layout, values: dict) -> tuple:
+        row = [None] * (max(layout.fields.values()) + 1)
+        for field, value in values.items():
+            row[layout.fields[field]] = value
+        return tuple(row)
+
+    def _spoil(self, rnd: random.Random, values: dict, rules) -> None:
+        """Очистка одного из полей, проверяемых правилами, для доли строк missing_ratio."""
+        if rnd.random() < self.missing_ratio:
+            rule = rnd.choice(rules.rules)
+            values[rnd.choice((*rule.filled, *rule.not_none))] = None
+
+    def travel(self, count: int, company_id: str = 'SYNTHETIC'):
+        """Строки хранимой процедуры CbtcTravelClick.
+
+        Args:
+            count (int): количество строк
+            company_id (str): идентификатор компании (поле company_id)
+
+        Yields:
+            tuple: строка выгрузки
+        """
+        rnd = random.Random(self.seed)
+        for i in range(count):
+            ru_surname, en_surname = rnd.choice(self.RU_SURNAMES)
+            ru_name, en_name = rnd.choice(self.RU_NAMES)
+            foreign = rnd.random() < self.foreign_ratio
+            holding = rnd.random() < self.holding_ratio
+            values = {
+                'company_id': company_id, 'tab_num': str(self.TAB_NUM_START + i),
+                'en_surname': en_surname, 'en_name': en_name,
+                'ru_surname': ru_surname, 'ru_name': ru_name, 'ru_middle_name': rnd.choice(self.MIDDLE_NAMES),
+                'birthday': self._date(rnd, 1960, 2004),
+                'country': rnd.choice(self.COUNTRIES) if foreign else 'RU',
+                'gender': rnd.choice(('MALE', 'FEMALE')),
+                'login': f'user{i}' if rnd.random() < 0.9 else None,
+                'position': rnd.choice(self.POSITIONS), 'unit_name': rnd.choice(self.UNITS), 'cost_name': rnd.randrange(1000, 9999),
+                'authorizer_tab_num': str(self.TAB_NUM_START + rnd.randrange(count)).zfill(8) if rnd.random() < 0.8 else None,
+                'role': self.holding_role if holding else 'sbt_user',
+                'travel_policy': 'HOLDING' if holding else rnd.choice(self.TRAVEL_POLICIES),
+            }
+            if not foreign:
+                values.update(ru_passport_number=f'{rnd.randrange(10**9, 10**10)}', ru_passport_issued=self._date(rnd, 2005, 2024),
+                              ru_place_of_birth=rnd.choice(self.CITIES))
+            if foreign or rnd.random() < 0.5: # у части россиян есть заграничный паспорт
+                values.update(en_passport_number=f'{rnd.randrange(10**8, 10**9)}', en_passport_issued=self._date(rnd, 2015, 2024),
+                              en_passport_expires=self._date(rnd, 2025, 2035))
+            self._spoil(rnd, values, TRAVEL_RULES)
+            yield self._row(TRAVEL_LAYOUT, values)
+
+    def aero(self, count: int):
+        """Строки хранимой процедуры AeroClub.
+
+        Args:
+            count (int): количество строк
+
+        Yields:
+            tuple: строка выгрузки
+        """
+        rnd = random.Random(self.seed)
+        for i in range(count):
+            ru_surname, en_surname = rnd.choice(self.RU_SURNAMES)
+            ru_name, en_name = rnd.choice(self.RU_NAMES)
+            foreign = rnd.random() < self.foreign_ratio
+            values = {
+                'ru_surname': ru_surname, 'ru_name': ru_name, 'ru_middle_name': rnd.choice(self.MIDDLE_NAMES),
+                'en_surname': en_surname, 'en_name': en_name,
+                'citizenship': rnd.choice(self.COUNTRIES) if foreign else 'RU',
+                'gender': rnd.choice(('m', 'f')), 'birthday': self._date(rnd, 1960, 2004),
+                'email': f'user{i}@synthetic.ru', 'tab_num': str(self.TAB_NUM_START + i), 'grade': rnd.randrange(5, 15),
+                'position': rnd.choice(self.POSITIONS), 'department': rnd.choice(self.UNITS), 'division': 'Synthetic',
+                'cost_center': f'CC{rnd.randrange(100, 999)}', 'manager_email': f'manager{rnd.randrange(100)}@synthetic.ru',
+            }
+            if not foreign:
+                values.update(ru_passport_series=f'{rnd.randrange(1000, 9999)}', ru_passport_number=f'{rnd.randrange(10**5, 10**6)}',
+                              ru_passport_issued=self._date(rnd, 2005, 2024))
+            if foreign or rnd.random() < 0.5:
+                values.update(en_passport_series=f'{rnd.randrange(10, 99)}', en_passport_number=f'{rnd.randrange(10**6, 10**7)}',
+                              en_passport_issued=self._date(rnd, 2015, 2024),
+                              en_passport_expires=rnd.choice((self._date(rnd, 2025, 2035), '')))
+            self._spoil(rnd, values, AERO_RULES)
+            yield self._row(AERO_LAYOUT, values)
@@ -0,0 +1,158 @@
+import contextvars
+import io
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+from config import Configuration, current_company
+
+class Span:
+    """Выполняющийся этап: счетчики заполняются кодом этапа, время вложенных этапов вычитается из его времени."""
+    def __init__(self, stage: str, company: str) -> None:
+        self.stage = stage
+        self.company = company
+        self.rows = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.attempts = 0   # http-попыток, повторы - все попытки после первой
+        self.nested = 0.0   # секунд во вложенных этапах
+
+class StageTimings:
+    """Длительности этапов запуска по компаниям: загрузка PAC-файла, соединение с БД, вызов хранимой процедуры,
+    чтение строк, формирование, сериализация, снимок, отправка и анализ ответа.\n
+    Этапы вкладываются друг в друга (чтение строк из БД идет внутри формирования при потоковой обработке),
+    каждому этапу учитывается только собственное время. Компания берется из current_company, этапы вне компаний
+    учитываются за запуском в целом. Один объект (stage_timings) общий для всех потоков запуска.
+    """
+    RUN = '' # ключ этапов вне компаний
+    STAGES = ('pac', 'db_connect', 'db_execute', 'db_fetch', 'build', 'serialize', 'snapshot', 'upload', 'analyze')
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._stats = dict() # компания -> этап -> счетчики
+        self._span = contextvars.ContextVar('stage_span', default=None)
+
+    @contextmanager
+    def measure(self, stage: str):
+        """Замер этапа.
+
+        Args:
+            stage (str): имя этапа из STAGES
+
+        Yields:
+            Span: счетчики этапа (строки, байты, попытки)
+        """
+        parent = self._span.get()
+        span = Span(stage, current_company.get())
+        token = self._span.set(span)
+        started = time.perf_counter()
+        try:
+            yield span
+        finally:
+            elapsed = time.perf_counter() - started
+            self._span.reset(token)
+            if parent is not None:
+                parent.nested += elapsed
+            self._record(span, elapsed - span.nested)
+
+    def iterate(self, stage: str, iterable):
+        """Перебор с замером получения каждого элемента (генераторы пачек и строк)."""
+        iterator = iter(iterable)
+        while True:
+            with self.measure(stage):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def attempt(self) -> None:
+        """Учет http-попытки в текущем этапе (вызывается и из потоков дублирования запроса)."""
+        span = self._span.get()
+        if span is not None:
+            with self._lock:
+                span.attempts += 1
+
+    def _record(self, span: Span, seconds: float) -> None:
+        with self._lock:
+            stats = self._stats.setdefault(span.company or self.RUN, dict()).setdefault(
+                span.stage, {'ms': 0.0, 'calls': 0, 'rows': 0, 'bytes_in': 0, 'bytes_out': 0, 'retries': 0})
+            stats['ms'] += seconds * 1000
+            stats['calls'] += 1
+            stats['rows'] += span.rows
+            stats['bytes_in'] += span.bytes_in
+            stats['bytes_out'] += span.bytes_out
+            stats['retries'] += max(0, span.attempts - 1)
+
+    def summary(self) -> dict:
+        """Счетчики этапов по компаниям.
+
+        Returns:
+            dict: компания ('' - запуск) -> этап -> ms, calls, rows, bytes_in, bytes_out, retries
+        """
+        with self._lock:
+            return {company: {stage: dict(stats) for stage, stats in stages.items()} for company, stages in self._stats.items()}
+
+    def format(self, company: str) -> str:
+        """Строка сводки по этапам компании для лога, пустая - если этапов не было."""
+        stages = self.summary().get(company or self.RUN, dict())
+        parts = list()
+        for stage in sorted(stages, key=lambda name: self.STAGES.index(name) if name in self.STAGES else len(self.STAGES)):
+            stats = stages[stage]
+            details = [f'строк {stats["rows"]}'] if stats['rows'] else []
+            details += [f'отправлено {stats["bytes_out"]} б'] if stats['bytes_out'] else []
+            details += [f'получено {stats["bytes_in"]} б'] if stats['bytes_in'] else []
+            details += [f'повторов {stats["retries"]}'] if stats['retries'] else []
+            parts.append(f'{stage} {stats["ms"]:.0f} мс' + (f' ({", ".join(details)})' if details else ''))
+        return ', '.join(parts)
+
+stage_timings = StageTimings()
+
+class RunProfiler:
+    """Профилирование запуска (--profile): cProfile и tracemalloc, результаты записываются в каталог логов.
+    cProfile учитывает только основной поток, потоки компаний и конвейера в профиль вызовов не попадают.
+    """
+    TOP_FUNCTIONS = 40
+    TOP_ALLOCATIONS = 25
+
+    def __init__(self, config: Configuration) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.enabled = config.is_profile
+        self.path = Path(os.path.dirname(config.settings.logging_config.handlers.file.filename) or '.')
+        self.profile = None
+
+    def __enter__(self):
+        if self.enabled:
+            import cProfile, tracemalloc # модули профилирования импортируются только с --profile
+            tracemalloc.start()
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        if not self.enabled:
+            return
+        import pstats, tracemalloc
+        self.profile.disable()
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        try:
+            self.path.mkdir(parents=True, exist_ok=True)
+            stats_path = self.path / f'profile_{stamp}.prof'
+            self.profile.dump_stats(stats_path)
+            report = io.StringIO()
+            pstats.Stats(self.profile, stream=report).sort_stats('cumulative').print_stats(self.TOP_FUNCTIONS)
+            report.write(f'\nПамять (tracemalloc): текущая {current / 2**20:.1f} МБ, пиковая {peak / 2**20:.1f} МБ\n')
+            for stat in snapshot.statistics('lineno')[:self.TOP_ALLOCATIONS]:
+                report.write(f'{stat}\n')
+            report_path = self.path / f'profile_{stamp}.txt'
+            report_path.write_text(report.getvalue(), encoding='utf-8')
+            self.logger.info(f"Профиль запуска записан: '{stats_path}', '{report_path}'")
+        except Exception as ex:
+            self.logger.error(f'Ошибка записи профиля запуска: {str(ex)}')
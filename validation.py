@@ -0,0 +1,102 @@
+import threading
+from collections import Counter
+
+class Rule:
+    """Правило проверки строки выгрузки.
+
+    Args:
+        code (str): код ошибки для счетчиков
+        message (str): текст ошибки для лога
+        filled (tuple): поля, которые должны быть заполнены (не пустые)
+        not_none (tuple): поля, которые не должны быть NULL
+        when (tuple): условие применения правила (поле, '==' или '!=', значение)
+    """
+    def __init__(self, code: str, message: str, filled=(), not_none=(), when=None) -> None:
+        self.code = code
+        self.message = message
+        self.filled = filled
+        self.not_none = not_none
+        self.when = when
+
+class RuleSet:
+    """Набор правил агентства, компилируемый в одну функцию проверки строки (без исключений).
+    Функция строится один раз на привязку колонок (row_layout.Columns) и возвращает первое нарушенное правило или None.
+    """
+    def __init__(self, name: str, rules: list) -> None:
+        self.name = name
+        self.rules = rules
+        self._compiled = dict() # индексы полей -> функция проверки
+        self._lock = threading.Lock()
+
+    def compile(self, columns):
+        """Функция проверки строки для привязки колонок.
+
+        Args:
+            columns (Columns): индексы полей строки
+
+        Returns:
+            Callable: row -> Rule или None
+        """
+        fields = sorted({field for rule in self.rules for field in (*rule.filled, *rule.not_none, *(rule.when[:1] if rule.when else ()))})
+        key = tuple(getattr(columns, field) for field in fields)
+        validate = self._compiled.get(key)
+        if validate is None:
+            with self._lock:
+                validate = self._compiled.setdefault(key, self._build(columns))
+        return validate
+
+    def _build(self, columns):
+        lines = ['def validate(row):']
+        for number, rule in enumerate(self.rules):
+            conditions = [f'not row[{getattr(columns, field)}]' for field in rule.filled]
+            conditions += [f'row[{getattr(columns, field)}] is None' for field in rule.not_none]
+            test = ' or '.join(conditions)
+            if rule.when:
+                field, operator, value = rule.when
+                test = f'row[{getattr(columns, field)}] {operator} {value!r} and ({test})'
+            lines.append(f'    if {test}: return rules[{number}]')
+        lines.append('    return None')
+        namespace = {'rules': self.rules}
+        exec(compile('\n'.join(lines), f'<rules {self.name}>', 'exec'), namespace)
+        return namespace['validate']
+
+class ValidationReport:
+    """Ошибки строк выгрузки, собранные за один проход: строки для лога и счетчики по кодам правил.
+    """
+    ERROR = 'error' # код для непредвиденных ошибок формирования
+    TERMINATED_NO_LOGIN = 'terminated_no_login' # уволенный сотрудник без логина, деактивацию отправить нельзя
+
+    def __init__(self) -> None:
+        self.errors = list()
+        self.counts = Counter()
+
+    def add(self, line: str, code: str) -> None:
+        self.errors.append(line)
+        self.counts[code] += 1
+
+    def merge(self, other) -> None:
+        self.errors += other.errors
+        self.counts.update(other.counts)
+
+    def summary(self) -> str:
+        return ', '.join(f'{code} - {count}' for code, count in self.counts.most_common())
+
+    def __len__(self) -> int:
+        return len(self.errors)
+
+TRAVEL_RULES = RuleSet('CbtcTravelClick', [
+    Rule('birthday', 'Не заполнен день рождения.', filled=('birthday',)),
+    Rule('country', 'Не заполнена страна.', filled=('country',)),
+    Rule('gender', 'Не заполнен пол.', filled=('gender',)),
+    Rule('ru_passport', 'Не заполнен российский паспорт.', not_none=('ru_passport_number', 'ru_passport_issued'), when=('country', '==', 'RU')),
+    Rule('foreign_passport', 'Не заполнен иностранный паспорт.', not_none=('en_passport_issued', 'en_passport_expires'), when=('country', '!=', 'RU')),
+    Rule('org_structure', 'Не заполнена орг.структура.', not_none=('position', 'unit_name', 'cost_name')),
+    Rule('roles', 'Не заполнены роли.', not_none=('role', 'travel_policy')),
+])
+
+AERO_RULES = RuleSet('AeroClub', [
+    Rule('birthday', 'Problem with bithday', not_none=('birthday',)),
+    Rule('gender', 'Problem with male', not_none=('gender',)),
+    Rule('citizenship', 'Problem with national', not_none=('citizenship',)),
+    Rule('org_structure', 'Problem with org structure', not_none=('grade', 'position', 'department', 'division')),
+])